@@ -0,0 +1,45 @@
+"""
+2段階の振り返り（reflect_on_summary + generate_requery）と統合プランナー（plan_research）の1ループあたりの時間を比較します。
+
+    python benchmarks/bench_planner.py --runs 3 --loops 3 --llm-delay 0.5
+
+既定では決まった時間だけ待つスタブ（stubs.py）を使います。--live で設定されたOllamaと検索APIを使います。
+"""
+import argparse
+import time
+
+from stubs import add_stub_arguments, install_stubs
+
+from deep_research.graph import get_graph
+
+#振り返りと検索クエリの生成に使われるノード
+PLANNER_NODES = ("reflect_on_summary", "generate_requery", "plan_research")
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the two-step reflection with the fused planner")
+    add_stub_arguments(parser)
+    parser.add_argument("--runs", type=int, default=3, help="設定ごとの実行回数")
+    parser.add_argument("--loops", type=int, default=3, help="max_web_research_loops")
+    args = parser.parse_args()
+
+    if not args.live:
+        install_stubs(llm_delay=args.llm_delay, search_delay=args.search_delay)
+
+    print(f"{'fused_planner':<14} {'seconds/loop':>13} {'planner calls/loop':>19} {'planner ms/loop':>16}")
+    for fused in [False, True]:
+        configurable = {"fused_planner": fused, "max_web_research_loops": args.loops}
+        seconds, loops, calls, planner_ms = 0.0, 0, 0, 0.0
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            out = get_graph().invoke({"research_topic": args.topic}, {"configurable": configurable})
+            seconds += time.perf_counter() - started
+            #summarize_sourcesは1ループに1回呼ばれる
+            loops += sum(1 for u in out["llm_usage"] if u["node"] == "summarize_sources")
+            planner = [u for u in out["llm_usage"] if u["node"] in PLANNER_NODES]
+            calls += len(planner)
+            planner_ms += sum(u["total_ms"] or 0 for u in planner)
+        loops = max(loops, 1)
+        print(f"{str(fused):<14} {seconds / loops:>13.2f} {calls / loops:>19.2f} {planner_ms / loops:>16.0f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""
+プロンプトのレイアウト（classic と prefix_stable）ごとに、ノード別のプロンプト評価時間とトークン数を比較します。
+
+    python benchmarks/bench_prompt_layout.py --topics 3 --live
+
+--live では Ollama が返す prompt_eval_count / prompt_eval_duration をそのまま集計します。
+スタブ（既定）では、モデルごとに直前のプロンプトと先頭が一致する部分をキャッシュ済みとみなし、
+残りの文字数 × --prompt-eval-per-char 秒をプロンプト評価時間として待つため、KVキャッシュの再利用を模擬できます。
+"""
+import argparse
+import time
+
+from stubs import add_stub_arguments, install_stubs, reset_prompt_cache
+
+from deep_research.graph import get_graph
+from deep_research.utils import summarize_llm_usage
+
+LAYOUTS = ["classic", "prefix_stable"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare prompt evaluation time of prompt layouts")
+    add_stub_arguments(parser)
+    parser.add_argument("--topics", type=int, default=3, help="レイアウトごとに続けて実行するトピック数")
+    parser.add_argument("--loops", type=int, default=2, help="max_web_research_loops")
+    parser.add_argument("--prompt-eval-per-char", type=float, default=0.00005, help="スタブのキャッシュされていない1文字あたりの評価秒数")
+    args = parser.parse_args()
+
+    if not args.live:
+        install_stubs(llm_delay=args.llm_delay, search_delay=args.search_delay, prompt_eval_per_char=args.prompt_eval_per_char)
+
+    for layout in LAYOUTS:
+        if not args.live:
+            reset_prompt_cache()
+        configurable = {"prompt_layout": layout, "max_web_research_loops": args.loops}
+        llm_usage = []
+        started = time.perf_counter()
+        for i in range(args.topics):
+            out = get_graph().invoke({"research_topic": f"{args.topic} {i + 1}"}, {"configurable": configurable})
+            llm_usage += out["llm_usage"]
+        seconds = time.perf_counter() - started
+
+        print(f"## {layout}: {seconds:.2f}s for {args.topics} topics")
+        print(f"{'node':<20} {'calls':>6} {'input tokens':>13} {'prompt eval ms':>15}")
+        totals = summarize_llm_usage(llm_usage)
+        for node, total in totals.items():
+            print(f"{node:<20} {int(total['calls']):>6} {int(total['input_tokens']):>13} {total['prompt_eval_ms']:>15.0f}")
+        print(f"{'total':<20} {sum(int(t['calls']) for t in totals.values()):>6} "
+              f"{sum(int(t['input_tokens']) for t in totals.values()):>13} "
+              f"{sum(t['prompt_eval_ms'] for t in totals.values()):>15.0f}")
+        print()
+
+if __name__ == "__main__":
+    main()
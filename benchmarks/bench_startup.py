@@ -0,0 +1,67 @@
+"""
+deep_research.graph のインポート時間と、グラフのコンパイル時間を計測します。
+
+    python benchmarks/bench_startup.py --top 20
+
+新しいプロセスで -X importtime を付けてインポートし、累積時間の大きいモジュールを表示します。
+あわせて、使われるまで読み込まないはずのモジュール（LAZY_MODULES）がインポート直後に読み込まれていないことを確認し、
+読み込まれていた場合は終了コード1を返します。
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+#検索バックエンドとLLMの呼び出しまで読み込まないモジュール
+LAZY_MODULES = ["tavily", "duckduckgo_search", "markdownify", "langchain_ollama"]
+
+#インポート直後に読み込まれているモジュールと、インポート・コンパイルの時間をJSONで出力する
+CHECK_SCRIPT = f"""
+import json, sys, time
+started = time.perf_counter()
+import deep_research.graph
+imported = time.perf_counter()
+loaded = [name for name in {LAZY_MODULES!r} if name in sys.modules]
+deep_research.graph.get_graph()
+compiled = time.perf_counter()
+print(json.dumps({{"import": imported - started, "compile": compiled - imported, "loaded": loaded}}))
+"""
+
+def run_python(*args: str) -> subprocess.CompletedProcess:
+    env = {**os.environ, "PYTHONPATH": SRC + os.pathsep + os.environ.get("PYTHONPATH", "")}
+    return subprocess.run([sys.executable, *args], env=env, capture_output=True, text=True, check=True)
+
+def parse_importtime(stderr: str):
+    """-X importtime の出力から（累積マイクロ秒, モジュール名）のリストを返します。"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        rows.append((int(cumulative), name.strip()))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure import and compile time of deep_research.graph")
+    parser.add_argument("--top", type=int, default=20, help="表示するモジュール数")
+    args = parser.parse_args()
+
+    rows = parse_importtime(run_python("-X", "importtime", "-c", "import deep_research.graph").stderr)
+    print(f"{'cumulative ms':>14}  module")
+    for cumulative, name in sorted(rows, reverse=True)[:args.top]:
+        print(f"{cumulative / 1000:>14.1f}  {name}")
+
+    result = json.loads(run_python("-c", CHECK_SCRIPT).stdout)
+    print()
+    print(f"import deep_research.graph: {result['import'] * 1000:.0f} ms")
+    print(f"get_graph() compile: {result['compile'] * 1000:.0f} ms")
+    if result["loaded"]:
+        print(f"Loaded at import time (should be lazy): {', '.join(result['loaded'])}")
+        sys.exit(1)
+    print(f"Not loaded at import time: {', '.join(LAZY_MODULES)}")
+
+if __name__ == "__main__":
+    main()
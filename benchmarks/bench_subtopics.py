@@ -0,0 +1,43 @@
+"""
+1本の検索ループとサブトピックへの分割（decompose_topic）の実行時間と網羅性を比較します。
+
+    python benchmarks/bench_subtopics.py --runs 3 --loops 2 --subtopics 3 --llm-delay 0.5
+
+網羅性は出力の source_urls（重複を除いた情報源のURL）の数で比べます。
+既定では決まった時間だけ待つスタブ（stubs.py）を使います。--live で設定されたOllamaと検索APIを使います。
+"""
+import argparse
+import time
+
+from stubs import add_stub_arguments, install_stubs
+
+from deep_research.graph import get_graph
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare wall-clock time and unique sources of the single chain and decomposed graphs")
+    add_stub_arguments(parser)
+    parser.add_argument("--runs", type=int, default=3, help="設定ごとの実行回数")
+    parser.add_argument("--loops", type=int, default=2, help="max_web_research_loops（サブトピックごとのループ回数にも使う）")
+    parser.add_argument("--subtopics", type=int, default=3, help="num_subtopics")
+    args = parser.parse_args()
+
+    if not args.live:
+        install_stubs(llm_delay=args.llm_delay, search_delay=args.search_delay)
+
+    print(f"{'decompose_topic':<16} {'seconds':>8} {'unique urls':>12} {'urls/second':>12} {'llm calls':>10}")
+    for decompose in [False, True]:
+        configurable = {"decompose_topic": decompose, "num_subtopics": args.subtopics,
+                        "max_web_research_loops": args.loops}
+        seconds, urls, calls = 0.0, 0, 0
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            out = get_graph().invoke({"research_topic": args.topic}, {"configurable": configurable})
+            seconds += time.perf_counter() - started
+            urls += len(out["source_urls"])
+            calls += len(out["llm_usage"])
+        runs = max(args.runs, 1)
+        print(f"{str(decompose):<16} {seconds / runs:>8.2f} {urls / runs:>12.1f} "
+              f"{urls / max(seconds, 1e-9):>12.2f} {calls / runs:>10.1f}")
+
+if __name__ == "__main__":
+    main()
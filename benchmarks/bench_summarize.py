@@ -0,0 +1,40 @@
+"""
+要約モード（single と map_reduce）の実行時間と合計トークン数を比較します。
+
+    python benchmarks/bench_summarize.py --runs 3 --llm-delay 0.5
+
+既定では決まった時間だけ待つスタブ（stubs.py）を使います。--live で設定されたOllamaと検索APIを使います。
+"""
+import argparse
+import time
+
+from stubs import add_stub_arguments, install_stubs
+
+from deep_research.graph import get_graph
+
+MODES = ["single", "map_reduce"]
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare single and map_reduce summarization")
+    add_stub_arguments(parser)
+    parser.add_argument("--runs", type=int, default=3, help="モードごとの実行回数")
+    parser.add_argument("--loops", type=int, default=2, help="max_web_research_loops")
+    args = parser.parse_args()
+
+    if not args.live:
+        install_stubs(llm_delay=args.llm_delay, search_delay=args.search_delay)
+
+    print(f"{'mode':<11} {'seconds/run':>12} {'llm calls':>10} {'tokens/run':>11}")
+    for mode in MODES:
+        configurable = {"summarize_mode": mode, "max_web_research_loops": args.loops}
+        seconds, calls, tokens = 0.0, 0, 0
+        for _ in range(args.runs):
+            started = time.perf_counter()
+            out = get_graph().invoke({"research_topic": args.topic}, {"configurable": configurable})
+            seconds += time.perf_counter() - started
+            calls += len(out["llm_usage"])
+            tokens += sum((u["input_tokens"] or 0) + (u["output_tokens"] or 0) for u in out["llm_usage"])
+        print(f"{mode:<11} {seconds / args.runs:>12.2f} {calls / args.runs:>10.1f} {tokens / args.runs:>11.0f}")
+
+if __name__ == "__main__":
+    main()
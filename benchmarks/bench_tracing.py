@@ -0,0 +1,62 @@
+"""
+trace デコレータの1回の呼び出しあたりのオーバーヘッドを計測します。
+
+    python benchmarks/bench_tracing.py --number 20000 --payload-chars 5000
+
+TRACE_MODE（off / local）とサンプリング率ごとに、何もしない関数とグラフのノードと同じ形（state, config）の関数を呼び出し、
+デコレータなしの呼び出しとの差をマイクロ秒で表示します。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+import uuid
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from deep_research.tracing import configure_tracing, flush_traces, trace  # noqa: E402
+
+#（TRACE_MODE, TRACE_SAMPLE_RATE）の組み合わせ
+SETTINGS = [("off", 1.0), ("local", 0.0), ("local", 0.1), ("local", 1.0)]
+
+def noop(text):
+    return text
+
+def node(state, config):
+    return {"running_summary": state["running_summary"]}
+
+def measure(func, number: int) -> float:
+    """1回あたりの秒数（3回計測した最小値）"""
+    return min(timeit.repeat(func, number=number, repeat=3)) / number
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure per-call overhead of deep_research.tracing.trace")
+    parser.add_argument("--number", type=int, default=20000, help="1回の計測で呼び出す回数")
+    parser.add_argument("--payload-chars", type=int, default=5000, help="引数の文字列の長さ")
+    args = parser.parse_args()
+
+    text = "x" * args.payload_chars
+    state = {"running_summary": text}
+    traced_noop = trace(name="noop")(noop)
+    traced_node = trace(name="node")(node)
+
+    baseline_noop = measure(lambda: noop(text), args.number)
+    baseline_node = measure(lambda: node(state, {"configurable": {"trace_id": uuid.uuid4().hex}}), args.number)
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"{'mode':<6} {'rate':>5} {'noop us/call':>13} {'node us/call':>13}")
+        for mode, rate in SETTINGS:
+            configure_tracing(mode=mode, sample_rate=rate, path=os.path.join(directory, "traces.jsonl"))
+            noop_seconds = measure(lambda: traced_noop(text), args.number)
+            #ノードは実行ごとにトレースIDが変わる場合を想定して、呼び出しごとに新しいtrace_idを渡す
+            node_seconds = measure(
+                lambda: traced_node(state, {"configurable": {"trace_id": uuid.uuid4().hex}}), args.number
+            )
+            #書き出しのコストは計測に含めない（バックグラウンドのスレッドが行う）
+            flush_traces()
+            print(f"{mode:<6} {rate:>5} {(noop_seconds - baseline_noop) * 1e6:>13.2f} {(node_seconds - baseline_node) * 1e6:>13.2f}")
+        configure_tracing(mode="off")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+ベンチマーク用に、Ollama と検索APIの代わりに決まった時間だけ待つスタブを用意します。
+
+install_stubs() で graph.get_chat_model と SEARCH_BACKENDS を置き換えると、GPU やネットワークがなくても、
+LLM と検索の呼び出し回数・並列度・プロンプトの長さによる実行時間の違いを比較できます。
+"""
+import hashlib
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, Optional
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from langchain_core.language_models.chat_models import BaseChatModel  # noqa: E402
+from langchain_core.messages import AIMessage  # noqa: E402
+from langchain_core.outputs import ChatGeneration, ChatResult  # noqa: E402
+
+from deep_research import graph  # noqa: E402
+from deep_research.configuration import SearchAPI  # noqa: E402
+from deep_research.utils import SEARCH_BACKENDS  # noqa: E402
+
+#1トークンあたりの文字数の目安（トークン数の見積もりに使う）
+CHARS_PER_TOKEN = 4
+
+#モデルごとに直前のプロンプトを保持し、先頭が一致する部分をKVキャッシュの再利用とみなす
+_prompt_cache: Dict[str, str] = {}
+_prompt_cache_lock = threading.Lock()
+_counter = itertools.count(1)
+
+def _cached_prefix(model: str, prompt: str) -> int:
+    with _prompt_cache_lock:
+        previous = _prompt_cache.get(model, "")
+        _prompt_cache[model] = prompt
+    return len(os.path.commonprefix([previous, prompt]))
+
+def reset_prompt_cache():
+    """スタブのKVキャッシュを空にします（モデルの再ロードに相当）。"""
+    with _prompt_cache_lock:
+        _prompt_cache.clear()
+
+class StubChatModel(BaseChatModel):
+    """
+    呼び出しごとに delay 秒と、キャッシュされていないプロンプトの評価時間（prompt_eval_per_char × 文字数）だけ待つモデル。
+
+    どのノードのJSONモードでも使える応答を返し、検索クエリは呼び出しごとに変える。
+    応答の usage_metadata と response_metadata は Ollama と同じキーを持つ。
+    """
+
+    model: str = "stub"
+    delay: float = 0.5
+    prompt_eval_per_char: float = 0.0
+    num_subtopics: int = 3
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub-chat-model"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        prompt = "\n".join(str(message.content) for message in messages)
+        uncached = len(prompt) - _cached_prefix(self.model, prompt)
+        prompt_eval = uncached * self.prompt_eval_per_char
+        time.sleep(prompt_eval + self.delay)
+
+        n = next(_counter)
+        content = json.dumps({
+            "query": f"stub query {n}",
+            "follow_up_query": f"stub follow up {n}",
+            "knowledge_gap": "stub gap",
+            "subtopics": [f"stub subtopic {i}" for i in range(1, self.num_subtopics + 1)],
+        })
+        message = AIMessage(
+            content=content,
+            usage_metadata={
+                "input_tokens": uncached // CHARS_PER_TOKEN,
+                "output_tokens": len(content) // CHARS_PER_TOKEN,
+                "total_tokens": (uncached + len(content)) // CHARS_PER_TOKEN,
+            },
+            response_metadata={
+                "model": self.model,
+                "prompt_eval_count": uncached // CHARS_PER_TOKEN,
+                "prompt_eval_duration": int(prompt_eval * 1e9),
+                "eval_count": len(content) // CHARS_PER_TOKEN,
+                "eval_duration": int(self.delay * 1e9),
+                "total_duration": int((prompt_eval + self.delay) * 1e9),
+            },
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+def install_stubs(llm_delay: float = 0.5, search_delay: float = 0.2, prompt_eval_per_char: float = 0.0,
+                  source_chars: int = 2000):
+    """graph.get_chat_model と SEARCH_BACKENDS をスタブに置き換えます。"""
+
+    def get_chat_model(configurable, model: str, timeout: Optional[float] = None, **kwargs):
+        return StubChatModel(model=model, delay=llm_delay, prompt_eval_per_char=prompt_eval_per_char,
+                             num_subtopics=configurable.num_subtopics)
+
+    def search(query: str, fetch_full_page: bool, research_loop_count: int,
+               max_results: Optional[int] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+        time.sleep(search_delay)
+        digest = hashlib.sha256(query.encode()).hexdigest()[:8]
+        return {"results": [{
+            "title": f"{query} ({i})",
+            "url": f"https://example.com/{digest}/{i}",
+            "content": f"Snippet {i} about {query}",
+            "raw_content": (f"Page {i} about {query}. " * source_chars)[:source_chars],
+        } for i in range(max_results or 3)]}
+
+    graph.get_chat_model = get_chat_model
+    for search_api in SearchAPI:
+        SEARCH_BACKENDS[search_api] = search
+
+def add_stub_arguments(parser):
+    """スタブの設定用の共通の引数を追加します。"""
+    parser.add_argument("--live", action="store_true", help="スタブを使わず、設定されたOllamaと検索APIを使う")
+    parser.add_argument("--llm-delay", type=float, default=0.5, help="スタブのLLM呼び出し1回あたりの秒数")
+    parser.add_argument("--search-delay", type=float, default=0.2, help="スタブの検索1回あたりの秒数")
+    parser.add_argument("--topic", default="ローカルLLMの推論高速化", help="リサーチトピック")
@@ -0,0 +1,184 @@
+import argparse
+import asyncio
+import json
+import os
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+from deep_research.graph import get_graph
+
+class ResultCollector:
+    """ストリームされたノードの更新から、結果とノードごとの処理時間を集めます。"""
+
+    def __init__(self, record: Dict[str, Any]):
+        self.record = record
+        self.started = time.perf_counter()
+        self.last = self.started
+        self.node_timings: List[Dict[str, Any]] = []
+        self.sources: List[str] = []
+        self.llm_usage: List[Dict[str, Any]] = []
+        self.running_summary: Optional[str] = None
+
+    def add(self, chunk: Dict[str, Any]):
+        #ノードは順番に実行されるため、前の更新からの経過時間をそのノードの処理時間とする
+        #並列に実行されるresearch_subtopicは続けて届くため、サブトピックごとに計測された時間を使う
+        now = time.perf_counter()
+        for node, update in chunk.items():
+            update = update or {}
+            if node == "research_subtopic":
+                for result in update.get("subtopic_results", []):
+                    self.node_timings.append({"node": node, "research_topic": result["research_topic"], "seconds": result["elapsed"]})
+            else:
+                self.node_timings.append({"node": node, "seconds": round(now - self.last, 3)})
+            if "sources_gathered" in update:
+                self.sources = update["sources_gathered"]
+            self.llm_usage.extend(update.get("llm_usage", []))
+            if node == "finalize_summary":
+                self.running_summary = update.get("running_summary")
+        self.last = now
+
+    def result(self, error: Optional[BaseException] = None) -> Dict[str, Any]:
+        return {
+            "key": topic_key(self.record),
+            "research_topic": self.record["research_topic"],
+            "status": "error" if error else "done",
+            "error": f"{type(error).__name__}: {error}" if error else None,
+            "running_summary": self.running_summary,
+            "sources": self.sources,
+            "node_timings": self.node_timings,
+            "llm_usage": self.llm_usage,
+            "elapsed": round(time.perf_counter() - self.started, 3),
+        }
+
+def topic_key(record: Dict[str, Any]) -> str:
+    """再開時に完了済みかどうかを判定するためのキー（idがなければトピック文字列）"""
+    return str(record.get("id", record["research_topic"]))
+
+def build_config(record: Dict[str, Any], configurable: Dict[str, Any]) -> Dict[str, Any]:
+    #トピックの実行ごとにトレースIDを付けて、ノードのスパンを1つのトレースにまとめる
+    return {"configurable": {"trace_id": uuid.uuid4().hex, **configurable, **record.get("configurable", {})}}
+
+def run_topic(record: Dict[str, Any], configurable: Dict[str, Any]) -> Dict[str, Any]:
+    """1つのトピックを同期的に実行します（プロセスプール用）。"""
+    collector = ResultCollector(record)
+    try:
+        for chunk in get_graph().stream({"research_topic": record["research_topic"]}, build_config(record, configurable), stream_mode="updates"):
+            collector.add(chunk)
+    except Exception as e:
+        return collector.result(e)
+    return collector.result()
+
+async def arun_topic(record: Dict[str, Any], configurable: Dict[str, Any]) -> Dict[str, Any]:
+    """1つのトピックを非同期で実行します。"""
+    collector = ResultCollector(record)
+    try:
+        async for chunk in get_graph().astream({"research_topic": record["research_topic"]}, build_config(record, configurable), stream_mode="updates"):
+            collector.add(chunk)
+    except Exception as e:
+        return collector.result(e)
+    return collector.result()
+
+def read_topics(path: str) -> Iterator[Dict[str, Any]]:
+    """JSONLからトピックを読み込みます。各行は research_topic（と任意の id, configurable）を持つ"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            if isinstance(record, str):
+                record = {"research_topic": record}
+            if not record.get("research_topic"):
+                raise ValueError(f"{path}:{line_no}: missing research_topic")
+            yield record
+
+def read_finished(path: str) -> Set[str]:
+    """出力ファイルから完了済みのトピックのキーを読み込みます（途中で切れた行は無視）"""
+    finished = set()
+    if not os.path.exists(path):
+        return finished
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if result.get("status") == "done":
+                finished.add(result["key"])
+    return finished
+
+async def run_async(records: List[Dict[str, Any]], configurable: Dict[str, Any], workers: int, write) -> None:
+    semaphore = asyncio.Semaphore(workers)
+
+    async def run_one(record):
+        async with semaphore:
+            write(await arun_topic(record, configurable))
+
+    await asyncio.gather(*(run_one(record) for record in records))
+
+def run_processes(records: List[Dict[str, Any]], configurable: Dict[str, Any], workers: int, write) -> None:
+    #結果の書き込みは親プロセスだけが行う
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_topic, record, configurable) for record in records]
+        for future in as_completed(futures):
+            write(future.result())
+
+def end_partial_line(path: str):
+    """中断で最後の行が途中で切れている場合は改行を追加し、次の結果がその行に続けて書かれないようにします。"""
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return
+    with open(path, "rb+") as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b"\n":
+            f.write(b"\n")
+
+def run_batch(input_path: str, output_path: str, workers: int = 2, mode: str = "async", configurable: Optional[Dict[str, Any]] = None) -> Tuple[int, int, float]:
+    """
+    JSONLのトピックを並列に実行し、終わったものから出力JSONLに追記します。
+
+    出力ファイルに status が done の結果があるトピックはスキップするため、
+    中断したスイープは同じコマンドで続きから再開できます。
+
+    Returns:
+        tuple: (成功件数, 失敗件数, 経過秒数)
+    """
+    configurable = configurable or {}
+    finished = read_finished(output_path)
+    records = [record for record in read_topics(input_path) if topic_key(record) not in finished]
+    print(f"{len(finished)} topics already finished, {len(records)} to run ({mode}, {workers} workers)")
+
+    counts = {"done": 0, "error": 0}
+    started = time.perf_counter()
+    end_partial_line(output_path)
+    with open(output_path, "a", encoding="utf-8") as out:
+        def write(result):
+            out.write(json.dumps(result, ensure_ascii=False) + "\n")
+            out.flush()
+            counts[result["status"]] += 1
+            print(f"[{counts['done'] + counts['error']}/{len(records)}] {result['status']}: {result['research_topic']} ({result['elapsed']}s)")
+
+        if mode == "process":
+            run_processes(records, configurable, workers, write)
+        else:
+            asyncio.run(run_async(records, configurable, workers, write))
+
+    return counts["done"], counts["error"], time.perf_counter() - started
+
+def main():
+    parser = argparse.ArgumentParser(description="Run deep research over a JSONL file of topics")
+    parser.add_argument("input", help="research_topic を含むJSONLファイル")
+    parser.add_argument("-o", "--output", required=True, help="結果を追記するJSONLファイル（再開時にも使う）")
+    parser.add_argument("-w", "--workers", type=int, default=2, help="同時に実行するトピック数")
+    parser.add_argument("--mode", choices=["async", "process"], default="async", help="非同期タスクまたはプロセスプール")
+    parser.add_argument("--configurable", default="{}", help="全トピックに適用するConfigurationのJSON")
+    args = parser.parse_args()
+
+    done, failed, elapsed = run_batch(args.input, args.output, args.workers, args.mode, json.loads(args.configurable))
+    total = done + failed
+    throughput = total / elapsed * 3600 if elapsed > 0 else 0.0
+    print(f"Finished {total} topics ({done} done, {failed} failed) in {elapsed:.1f}s: {throughput:.1f} topics/hour")
+
+if __name__ == "__main__":
+    main()
@@ -18,6 +18,23 @@ class Configuration(BaseModel):
         title="Research Depth",
         description="Number of research iterations to perform"
     )
+    #リサーチトピックをサブトピックに分割し、それぞれを並列に調査するかどうか
+    decompose_topic: bool = Field(
+        default=False,
+        title="Decompose Topic",
+        description="Split the research topic into sub-topics researched in parallel"
+    )
+    num_subtopics: int = Field(
+        default=3,
+        title="Number of Sub-topics",
+        description="Number of sub-topics to split the research topic into"
+    )
+    #サブトピックごとのループ回数（未指定の場合はmax_web_research_loops）
+    subtopic_max_loops: Optional[int] = Field(
+        default=None,
+        title="Sub-topic Research Depth",
+        description="Number of research iterations per sub-topic (defaults to max_web_research_loops)"
+    )
     #JSON用LLM
     local_llm: str = Field(
         default="hhao/qwen2.5-coder-tools:32b",
@@ -36,6 +53,39 @@ class Configuration(BaseModel):
         title="LLM Model Name",
         description="Name of the LLM model to use"
     )
+    #要約の方式（single: 1つのプロンプトで要約、map_reduce: ソースごとに並列で要約してから統合）
+    summarize_mode: Literal["single", "map_reduce"] = Field(
+        default="single",
+        title="Summarize Mode",
+        description="How to summarize search results: one prompt or map-reduce over sources"
+    )
+    #map_reduceでソースごとの要約に使うLLM（未指定の場合はsum_llm）
+    map_llm: Optional[str] = Field(
+        default=None,
+        title="Map LLM Model Name",
+        description="Name of the LLM model used to condense each source (defaults to sum_llm)"
+    )
+    map_max_tokens: int = Field(
+        default=512,
+        title="Map Max Tokens",
+        description="Maximum number of tokens generated per condensed source"
+    )
+    map_concurrency: int = Field(
+        default=4,
+        title="Map Concurrency",
+        description="Maximum number of sources condensed in parallel"
+    )
+    #reflect_on_summaryとgenerate_requeryを1回のLLM呼び出しにまとめるかどうか
+    fused_planner: bool = Field(
+        default=False,
+        title="Fused Planner",
+        description="Produce knowledge gap, follow-up question and search keywords in one LLM call"
+    )
+    planner_max_retries: int = Field(
+        default=1,
+        title="Planner Max Retries",
+        description="Number of retries for fields that failed validation in the fused planner"
+    )
     max_tokens: int = Field(
         default=4096,
         title="Max Tokens",
@@ -62,6 +112,47 @@ class Configuration(BaseModel):
         title="Ollama Base URL",
         description="Base URL for Ollama API"
     )
+    #プロンプトの並べ方（prefix_stable: 固定の指示を先頭に置き、可変の内容を末尾に置く）
+    prompt_layout: Literal["classic", "prefix_stable"] = Field(
+        default="classic",
+        title="Prompt Layout",
+        description="Prompt layout; prefix_stable puts static instructions first so Ollama can reuse the cached prefix"
+    )
+    ollama_keep_alive: str = Field(
+        default="30m",
+        title="Ollama Keep Alive",
+        description="How long Ollama keeps each model loaded between calls"
+    )
+    #コンテキスト長（未指定の場合はモデルの既定値）。呼び出しごとに変わるとモデルが再ロードされKVキャッシュが失われる
+    num_ctx: Optional[int] = Field(
+        default=None,
+        title="Context Window",
+        description="Fixed context window size passed to Ollama for every call"
+    )
+    #実行全体の制限時間（秒）。未指定の場合は制限なし
+    deadline_seconds: Optional[float] = Field(
+        default=None,
+        title="Deadline Seconds",
+        description="Overall time limit for one research run"
+    )
+    #finalize_summaryのために残しておく時間（秒）。残り時間がこれを下回るとループをやめ、検索や生成を縮小する
+    #deadline_secondsの1/4を上限とする（短いdeadlineでも検索を行えるようにする）
+    deadline_reserve_seconds: float = Field(
+        default=60.0,
+        title="Deadline Reserve Seconds",
+        description="Time kept in reserve for finalize_summary when a deadline is set (capped at a quarter of deadline_seconds)"
+    )
+    deadline_tokens_per_second: float = Field(
+        default=20.0,
+        title="Deadline Tokens Per Second",
+        description="Estimated generation speed used to cap max tokens when a deadline is set"
+    )
+    #ノードごとのプロファイル（cProfileとtracemalloc）の出力先。未指定の場合はプロファイリングしない
+    profile_dir: Optional[str] = Field(
+        default=None,
+        title="Profile Directory",
+        description="Directory for per-node CPU and allocation profiling reports; disabled when unset"
+    )
     #LLMの出力に含まれる <think> のような特殊トークンを削除するかどうか
     strip_thinking_tokens: bool = Field(
         default=True,
@@ -1,41 +1,115 @@
 import json
+import time
+from functools import lru_cache
+from typing import TYPE_CHECKING, Optional
 from typing_extensions import Literal
-from langchain_core.messages import HumanMessage, SystemMessage
+from pydantic import ValidationError
+from langchain_core.messages import AIMessage, HumanMessage
 from langchain_core.runnables import RunnableConfig
-from langchain_ollama import ChatOllama
 from langgraph.graph import START, END, StateGraph
+from langgraph.types import Send
 from deep_research.configuration import Configuration, SearchAPI
-from deep_research.utils import deduplicate_and_format_sources, tavily_search, format_sources, perplexity_search, duckduckgo_search, strip_thinking_tokens, get_config_value
-from deep_research.state import SummaryState, SummaryStateInput, SummaryStateOutput
-from deep_research.prompts import query_writer_instructions,query_writer_user, summarizer_instructions,summarizer_user,reflection_instructions,reflection_user,get_current_date,requery_instructions,requery_user,final_instructions,final_user
-from langsmith import traceable
+from deep_research.utils import deduplicate_and_format_sources, deduplicate_sources, format_source, format_sources, get_search_backend, strip_thinking_tokens, get_llm_usage, is_timeout_error
+from deep_research.state import SummaryState, SummaryStateInput, SummaryStateOutput, ResearchPlan
+from deep_research.prompts import build_messages,get_current_date,planner_retry_user
+from deep_research.profiling import profile_node
+from deep_research.tracing import run_tree, trace
 from datetime import datetime
 
-@traceable(name="generate_query_node")
+if TYPE_CHECKING:
+    from langchain_ollama import ChatOllama
+
+#予備時間（deadline_reserve_seconds）がdeadline_secondsに占める割合の上限
+#（短いdeadlineで予備時間が実行時間のすべてを使い、検索が1回も行われないことを防ぐ）
+DEADLINE_RESERVE_FRACTION = 0.25
+
+#summarize_sourcesで新しい内容を要約に加えるために、既存の要約の長さに加えて必要とする生成トークン数
+MIN_SUMMARY_TOKENS = 256
+
+def get_chat_model(configurable: Configuration, model: str, timeout: Optional[float] = None, **kwargs) -> "ChatOllama":
+    """設定に基づいてOllamaのチャットモデルを作成します（timeoutはHTTPクライアントのタイムアウト秒数）。"""
+
+    #langchain_ollama（ollama, httpx）は最初のLLM呼び出しまでインポートしない
+    from langchain_ollama import ChatOllama
+
+    #keep_aliveでモデルを常駐させ、num_ctxを固定してランナーの再ロードを防ぐことで、
+    #同じモデルへの連続した呼び出しがKVキャッシュのプレフィックスを共有できるようにする
+    return ChatOllama(
+        base_url=configurable.ollama_base_url,
+        model=model,
+        temperature=0,
+        keep_alive=configurable.ollama_keep_alive,
+        num_ctx=configurable.num_ctx,
+        client_kwargs={"timeout": max(timeout, 1.0)} if timeout is not None else {},
+        **kwargs
+    )
+
+def get_deadline_at(state: SummaryState, configurable: Configuration) -> Optional[float]:
+    """実行全体の期限を返します（まだ決まっていなければdeadline_secondsから決める。制限がない場合はNone）"""
+
+    if state.deadline_at is None and configurable.deadline_seconds is not None:
+        return time.time() + configurable.deadline_seconds
+    return state.deadline_at
+
+def get_reserve_seconds(configurable: Configuration) -> float:
+    """finalize_summary用の予備時間を返します（deadline_secondsのDEADLINE_RESERVE_FRACTIONを上限とする）"""
+
+    if configurable.deadline_seconds is None:
+        return configurable.deadline_reserve_seconds
+    return min(configurable.deadline_reserve_seconds, configurable.deadline_seconds * DEADLINE_RESERVE_FRACTION)
+
+def get_time_budget(state: SummaryState, configurable: Configuration) -> Optional[float]:
+    """deadlineまでの残り秒数から、finalize_summary用の予備時間を引いた秒数を返します（deadlineがない場合はNone）"""
+
+    if state.deadline_at is None:
+        return None
+    return state.deadline_at - time.time() - get_reserve_seconds(configurable)
+
+def cap_tokens(configurable: Configuration, seconds: Optional[float]) -> int:
+    """残り時間内に生成できる目安のトークン数でmax_tokensを制限します。"""
+
+    if seconds is None:
+        return configurable.max_tokens
+    return max(64, min(configurable.max_tokens, int(seconds * configurable.deadline_tokens_per_second)))
+
+def append_to_summary(existing_summary: Optional[str], new_research: str) -> str:
+    """LLMで書き直せない場合に、既存の要約を残したまま新しい検索結果（またはメモ）を後ろに追加します。"""
+
+    return "\n\n".join(text for text in (existing_summary, new_research) if text)
+
+@trace(name="generate_query_node")
 def generate_query(state: SummaryState, config: RunnableConfig):
     """リサーチトピックに基づいて初期の検索クエリを生成します"""
     
     #設定情報（LLMや検索APIの情報）を取り出し
     configurable = Configuration.from_runnable_config(config)
+
+    #実行全体の期限を設定（以降のノードはstate.deadline_atを参照する）
+    deadline_at = get_deadline_at(state, configurable)
+    state.deadline_at = deadline_at
+    budget = get_time_budget(state, configurable)
+
+    #時間がない場合はLLMを使わず、トピックをそのまま検索クエリにする
+    if budget is not None and budget <= 0:
+        return {"search_query": state.research_topic, "deadline_at": deadline_at}
     
     #LLMの設定
-    llm_json_mode = ChatOllama(
-        base_url=configurable.ollama_base_url, 
-        model=configurable.local_llm,
-        temperature=0, 
-        format="json"
-    )
+    llm_json_mode = get_chat_model(configurable, configurable.local_llm, timeout=budget, format="json")
 
     current_date = get_current_date()
     
     #プロンプトを与えてLLMを実行
-    result = llm_json_mode.invoke(
-        [SystemMessage(content=query_writer_instructions),
-        HumanMessage(content=query_writer_user.format(
-            current_date=current_date,
-            research_topic=state.research_topic
-        ))]
-    )
+    try:
+        result = llm_json_mode.invoke(
+            build_messages("query_writer", configurable.prompt_layout,
+                current_date=current_date,
+                research_topic=state.research_topic
+            )
+        )
+    except Exception as e:
+        if not is_timeout_error(e):
+            raise
+        return {"search_query": state.research_topic, "deadline_at": deadline_at}
     
     #LLMが生成した文字列を取得
     content = result.content
@@ -51,103 +125,186 @@ def generate_query(state: SummaryState, config: RunnableConfig):
             content = strip_thinking_tokens(content)
         #テキストそのものをクエリとして使う
         search_query = content
-    return {"search_query": search_query}
+    return {"search_query": search_query,
+            "deadline_at": deadline_at,
+            "llm_usage": [get_llm_usage(result, "generate_query")]}
 
-@traceable(name="web_research_node")
+@trace(name="web_research_node")
 def web_research(state: SummaryState, config: RunnableConfig):
     """生成された検索クエリを使用してWeb検索を実行します。"""
 
     # 設定情報（LLMや検索APIの情報）を取り出し
     configurable = Configuration.from_runnable_config(config)
 
-    #configurable.search_apiの設定値を文字列に変換する
-    search_api = get_config_value(configurable.search_api)
-
-    #search_apiによって、検索ツールを選択して、検索を実行する
-    if search_api == "tavily":
-        search_results = tavily_search(state.search_query, fetch_full_page=configurable.fetch_full_page, max_results=2)
-        search_str = deduplicate_and_format_sources(search_results, max_tokens_per_source=1000, fetch_full_page=configurable.fetch_full_page)
-    elif search_api == "perplexity":
-        search_results = perplexity_search(state.search_query, state.research_loop_count)
-        search_str = deduplicate_and_format_sources(search_results, max_tokens_per_source=1000, fetch_full_page=configurable.fetch_full_page)
-    elif search_api == "duckduckgo":
-        search_results = duckduckgo_search(state.search_query, max_results=3, fetch_full_page=configurable.fetch_full_page)
-        search_str = deduplicate_and_format_sources(search_results, max_tokens_per_source=1000, fetch_full_page=configurable.fetch_full_page)
-    else:
-        raise ValueError(f"Unsupported search API: {configurable.search_api}")
+    #時間がない場合は検索をせずにループを進める（新しい検索結果がないことを空文字列で示す）
+    budget = get_time_budget(state, configurable)
+    if budget is not None and budget <= 0:
+        return {"research_loop_count": state.research_loop_count + 1, "web_research_results": [""], "latest_sources": []}
+
+    #残り時間が予備時間より短い場合は、ページ全文の取得をやめて検索件数を1件に減らす
+    fetch_full_page = configurable.fetch_full_page
+    max_results = None
+    if budget is not None and budget < get_reserve_seconds(configurable):
+        fetch_full_page = False
+        max_results = 1
+
+    #search_apiによって、検索バックエンドを選択して、検索を実行する（未対応のAPIはValueError）
+    search_backend = get_search_backend(configurable.search_api)
+    try:
+        search_results = search_backend(
+            state.search_query,
+            fetch_full_page=fetch_full_page,
+            research_loop_count=state.research_loop_count,
+            max_results=max_results,
+            timeout=budget
+        )
+    except Exception as e:
+        #タイムアウトした場合は検索結果なしでループを進める
+        if not is_timeout_error(e):
+            raise
+        return {"research_loop_count": state.research_loop_count + 1, "web_research_results": [""], "latest_sources": []}
+    search_str = deduplicate_and_format_sources(search_results, max_tokens_per_source=1000, fetch_full_page=fetch_full_page)
 
     #検索結果の履歴があればそれを引き継ぎ、なければ空リストを作成
     sources_gathered = list(state.sources_gathered) if state.sources_gathered else []
     sources_gathered.append(format_sources(search_results))
 
+    #map_reduce要約用に、ソースごとに整形したテキストも保持する
+    latest_sources = [
+        format_source(source, max_tokens_per_source=1000, fetch_full_page=fetch_full_page)
+        for source in deduplicate_sources(search_results)
+    ]
+
     return {
         "sources_gathered": sources_gathered,
         "research_loop_count": state.research_loop_count + 1,
         "web_research_results": [search_str],
+        "latest_sources": latest_sources,
     }
 
-@traceable(name="summarize_sources_node")
+@trace(name="summarize_sources_node")
 def summarize_sources(state: SummaryState, config: RunnableConfig):
     """Web検索の結果を要約します。"""
 
     existing_summary = state.running_summary
 
     #過去に実行したWeb検索結果の中から最後の結果を取得
-    most_recent_web_research = state.web_research_results[-1]
+    most_recent_web_research = state.web_research_results[-1] if state.web_research_results else ""
+
+    #今回のループで新しい検索結果がない場合（検索の省略やタイムアウト）は、要約をそのまま残す
+    if not most_recent_web_research:
+        return {}
 
     # 設定情報（LLMや検索APIの情報）を取り出し
     configurable = Configuration.from_runnable_config(config)
+
+    #時間がない場合は、既存の要約を残して検索結果を追記する
+    budget = get_time_budget(state, configurable)
+    if budget is not None and budget <= 0:
+        return {"running_summary": append_to_summary(existing_summary, most_recent_web_research)}
     
+    llm_usage = []
+
+    #map_reduceの場合、ソースごとに並列で要点を抽出し、そのメモを要約の入力にする（時間が短い場合は1回の要約にする）
+    short_on_time = budget is not None and budget < get_reserve_seconds(configurable)
+    if configurable.summarize_mode == "map_reduce" and state.latest_sources and not short_on_time:
+        try:
+            most_recent_web_research, llm_usage = condense_sources(state, configurable, timeout=budget)
+        except Exception as e:
+            #タイムアウトした場合は、検索結果をそのまま要約に使う
+            if not is_timeout_error(e):
+                raise
+
+        budget = get_time_budget(state, configurable)
+
+    #要約は既存の要約ごと書き直すため、残り時間で生成できるトークン数が既存の要約の長さ（文字数で見積もる）に
+    #MIN_SUMMARY_TOKENSを足した分に満たない場合は、途中で切れた要約で置き換えず、既存の要約にメモや検索結果を追記する
+    fallback = {"running_summary": append_to_summary(existing_summary, most_recent_web_research), "llm_usage": llm_usage}
+    if budget is not None and budget <= 0:
+        return fallback
+    num_predict = cap_tokens(configurable, budget)
+    if num_predict < configurable.max_tokens and num_predict < len(existing_summary or "") + MIN_SUMMARY_TOKENS:
+        return fallback
+
     #LLMの設定
-    sum_llm = ChatOllama(
-        base_url=configurable.ollama_base_url, 
-        model=configurable.sum_llm,
-        max_tokens=configurable.max_tokens,
-        temperature=0,
-    )
+    sum_llm = get_chat_model(configurable, configurable.sum_llm, timeout=budget, num_predict=num_predict)
 
     #LLMにプロンプトを与えて実行
-    result = sum_llm.invoke(
-        [SystemMessage(content=summarizer_instructions),
-         HumanMessage(content=summarizer_user.format(
-             research_topic=state.research_topic,
-             most_recent_web_research=most_recent_web_research,
-             existing_summary=existing_summary
-             )
-        )]
-    )
+    try:
+        result = sum_llm.invoke(
+            build_messages("summarizer", configurable.prompt_layout,
+                research_topic=state.research_topic,
+                most_recent_web_research=most_recent_web_research,
+                existing_summary=existing_summary
+            )
+        )
+    except Exception as e:
+        if not is_timeout_error(e):
+            raise
+        return fallback
     
     #LLMが生成した要約をrunning_summaryとして返す
     running_summary = result.content
     #if configurable.strip_thinking_tokens:
         #running_summary = strip_thinking_tokens(running_summary)
+    llm_usage.append(get_llm_usage(result, "summarize_sources"))
     
-    return {"running_summary": running_summary}
+    return {"running_summary": running_summary,
+            "llm_usage": llm_usage}
+
+def condense_sources(state: SummaryState, configurable: Configuration, timeout: Optional[float] = None):
+    """最新の検索結果をソースごとに並列で要約し、統合用のメモを作成します。"""
+
+    #LLMの設定（map_llmが未指定の場合はsum_llmを使う）
+    map_llm = get_chat_model(configurable, configurable.map_llm or configurable.sum_llm, timeout=timeout, num_predict=configurable.map_max_tokens)
+
+    #ソースごとのプロンプトをmap_concurrencyの並列数で実行
+    results = map_llm.batch(
+        [build_messages("map", configurable.prompt_layout,
+            research_topic=state.research_topic,
+            source=source
+         )
+         for source in state.latest_sources],
+        config={"max_concurrency": configurable.map_concurrency},
+    )
+
+    notes = []
+    for i, result in enumerate(results, 1):
+        content = result.content
+        if configurable.strip_thinking_tokens:
+            content = strip_thinking_tokens(content)
+        notes.append(f"Source {i} notes:\n{content.strip()}")
 
-@traceable(name="reflect_on_summary_node")
+    return "\n\n".join(notes), [get_llm_usage(result, "condense_sources") for result in results]
+
+@trace(name="reflect_on_summary_node")
 def reflect_on_summary(state: SummaryState, config: RunnableConfig):
     """追加リサーチの内容を生成します。"""
 
     #設定情報（LLMや検索APIの情報）を取り出し
     configurable = Configuration.from_runnable_config(config)
+
+    #時間がない場合は何もしない（route_researchがfinalize_summaryへ進める）
+    budget = get_time_budget(state, configurable)
+    if budget is not None and budget <= 0:
+        return {}
     
     #LLMの設定
-    llm_json_mode = ChatOllama(
-        base_url=configurable.ollama_base_url, 
-        model=configurable.local_llm,
-        temperature=0, 
-        format="json"
-    )
+    llm_json_mode = get_chat_model(configurable, configurable.local_llm, timeout=budget, format="json")
 
     #プロンプトをLLMに与えて実行
-    result = llm_json_mode.invoke(
-        [SystemMessage(content=reflection_instructions),
-         HumanMessage(content=reflection_user.format(
-             research_topic=state.research_topic,
-             running_summary=state.running_summary,
-             query_history = "\n".join(f"- {q}" for q in state.query_history)
-             ))
-        ])
+    try:
+        result = llm_json_mode.invoke(
+            build_messages("reflection", configurable.prompt_layout,
+                research_topic=state.research_topic,
+                running_summary=state.running_summary,
+                query_history="\n".join(f"- {q}" for q in state.query_history)
+            )
+        )
+    except Exception as e:
+        if not is_timeout_error(e):
+            raise
+        return {}
     
     try:
         #LLMが返したJSONをPythonの辞書に変換
@@ -167,10 +324,11 @@ def reflect_on_summary(state: SummaryState, config: RunnableConfig):
 
     return {
         "search_query": query,
-        "query_history": query_history
+        "query_history": query_history,
+        "llm_usage": [get_llm_usage(result, "reflect_on_summary")]
     }
 
-@traceable(name="generate_requery_node")
+@trace(name="generate_requery_node")
 def generate_requery(state: SummaryState, config: RunnableConfig):
     """reflect_on_summaryの結果を元に検索クエリを作成します。"""
 
@@ -178,18 +336,17 @@ def generate_requery(state: SummaryState, config: RunnableConfig):
     configurable = Configuration.from_runnable_config(config)
 
     #LLMの設定
-    llm_json_mode = ChatOllama(
-        base_url=configurable.ollama_base_url,
-        model=configurable.local_llm,
-        temperature=0,
-        format="json"
-    )
+    llm_json_mode = get_chat_model(configurable, configurable.local_llm, timeout=get_time_budget(state, configurable), format="json")
 
-    #プロンプトをLLMに与えて実行
-    result = llm_json_mode.invoke([
-        SystemMessage(content=requery_instructions),
-        HumanMessage(content=requery_user.format(long_query=state.search_query))
-     ])
+    #プロンプトをLLMに与えて実行（タイムアウトした場合は質問文をそのまま検索に使う）
+    try:
+        result = llm_json_mode.invoke(
+            build_messages("requery", configurable.prompt_layout, long_query=state.search_query)
+        )
+    except Exception as e:
+        if not is_timeout_error(e):
+            raise
+        return {}
     content = result.content
 
     try:
@@ -208,27 +365,268 @@ def generate_requery(state: SummaryState, config: RunnableConfig):
     short_query_history.append(short_query)
 
     return {"search_query": short_query,
-           "short_query_history": short_query_history}
+           "short_query_history": short_query_history,
+           "llm_usage": [get_llm_usage(result, "generate_requery")]}
 
-@traceable(name="route_research_node")
+def parse_research_plan(content: str) -> dict:
+    """LLMの出力をResearchPlanで検証し、検証に通ったフィールドだけを返します。"""
+
+    try:
+        return ResearchPlan.model_validate_json(content).model_dump()
+    except ValidationError as e:
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+        #エラーになったフィールドを除き、残りのフィールドを採用する
+        failed = {error["loc"][0] for error in e.errors() if error["loc"]}
+        return {
+            name: data[name].strip()
+            for name in ResearchPlan.model_fields
+            if name not in failed and isinstance(data.get(name), str) and data[name].strip()
+        }
+
+@trace(name="plan_research_node")
+def plan_research(state: SummaryState, config: RunnableConfig):
+    """不足分の特定、追加リサーチの質問文、検索キーワードを1回のLLM呼び出しで生成します。"""
+
+    #設定情報（LLMや検索APIの情報）を取り出し
+    configurable = Configuration.from_runnable_config(config)
+
+    #時間がない場合は何もしない（route_planned_researchがfinalize_summaryへ進める）
+    budget = get_time_budget(state, configurable)
+    if budget is not None and budget <= 0:
+        return {}
+
+    #スキーマ付きのJSONモードでLLMを設定
+    schema = ResearchPlan.model_json_schema()
+    llm_json_mode = get_chat_model(configurable, configurable.local_llm, timeout=budget, format=schema)
+
+    messages = build_messages("planner", configurable.prompt_layout,
+        research_topic=state.research_topic,
+        running_summary=state.running_summary,
+        query_history="\n".join(f"- {q}" for q in state.query_history)
+    )
+    try:
+        result = llm_json_mode.invoke(messages)
+    except Exception as e:
+        if not is_timeout_error(e):
+            raise
+        return {}
+    llm_usage = [get_llm_usage(result, "plan_research")]
+    plan = parse_research_plan(result.content)
+
+    #検証に失敗したフィールドだけを、前回の出力に続けて再生成する
+    for _ in range(configurable.planner_max_retries):
+        missing_fields = [name for name in ResearchPlan.model_fields if name not in plan]
+        budget = get_time_budget(state, configurable)
+        if not missing_fields or (budget is not None and budget <= 0):
+            break
+        retry_llm = get_chat_model(configurable, configurable.local_llm, timeout=budget, format={
+            "type": "object",
+            "properties": {name: schema["properties"][name] for name in missing_fields},
+            "required": missing_fields,
+        })
+        messages = messages + [
+            AIMessage(content=result.content),
+            HumanMessage(content=planner_retry_user.format(missing_fields=", ".join(missing_fields)))
+        ]
+        try:
+            result = retry_llm.invoke(messages)
+        except Exception as e:
+            if not is_timeout_error(e):
+                raise
+            break
+        llm_usage.append(get_llm_usage(result, "plan_research"))
+        retried = parse_research_plan(result.content)
+        plan.update({name: retried[name] for name in missing_fields if name in retried})
+
+    #再試行しても得られなかった場合は、質問文を検索キーワードに、トピックの汎用クエリを質問文に使う
+    follow_up_query = plan.get("follow_up_query") or f"{state.research_topic}について教えて下さい"
+    short_query = plan.get("query") or follow_up_query
+
+    #履歴があればそれを使い、なければ空リストを使う
+    query_history = list(state.query_history) if state.query_history else []
+    query_history.append(follow_up_query)
+    short_query_history = list(state.short_query_history) if state.short_query_history else []
+    short_query_history.append(short_query)
+
+    return {
+        "search_query": short_query,
+        "query_history": query_history,
+        "short_query_history": short_query_history,
+        "llm_usage": llm_usage
+    }
+
+@trace(name="route_planner_node")
+def route_planner(state: SummaryState, config: RunnableConfig) -> Literal["reflect_on_summary", "plan_research"]:
+    """要約後に、2段階の振り返りか統合プランナーのどちらを使うかを決定します。"""
+
+    configurable = Configuration.from_runnable_config(config)
+    if configurable.fused_planner:
+        return "plan_research"
+    return "reflect_on_summary"
+
+@trace(name="route_research_node")
 def route_research(state: SummaryState, config: RunnableConfig) -> Literal["generate_requery", "finalize_summary"]:
     """追加の検索か最終的なサマリーに移行するかを決定します。"""
 
     configurable = Configuration.from_runnable_config(config)
-    #ループ回数が設定された最大数に達していなければ、Web検索（generate_requery）へ進み
-    if state.research_loop_count <= configurable.max_web_research_loops:
+
+    #deadlineがある場合、これまでの1ループあたりの平均時間が残り時間に収まらなければ、残りのループを飛ばす
+    budget = get_time_budget(state, configurable)
+    if budget is not None:
+        elapsed = configurable.deadline_seconds - (state.deadline_at - time.time()) if configurable.deadline_seconds else 0
+        per_loop = elapsed / max(state.research_loop_count, 1)
+        if budget < per_loop:
+            return "finalize_summary"
+
+    #ループ回数が設定された最大数（サブトピックではstate.max_loops）に達していなければ、Web検索（generate_requery）へ進み
+    max_loops = state.max_loops if state.max_loops is not None else configurable.max_web_research_loops
+    if state.research_loop_count <= max_loops:
         return "generate_requery"
     #ループ回数が設定された最大数に達していれば、最終的な回答（finalize_summary）へ進む
     else:
         return "finalize_summary"
 
+@trace(name="route_planned_research_node")
+def route_planned_research(state: SummaryState, config: RunnableConfig) -> Literal["web_research", "finalize_summary"]:
+    """統合プランナーの後に、Web検索か最終的なサマリーに移行するかを決定します。"""
+
+    #検索キーワードは生成済みのため、generate_requeryを飛ばしてWeb検索へ進む
+    if route_research(state, config) == "generate_requery":
+        return "web_research"
+    return "finalize_summary"
+
+
+@trace(name="route_start_node")
+def route_start(state: SummaryState, config: RunnableConfig) -> Literal["generate_query", "decompose_topic"]:
+    """トピックをそのまま調査するか、サブトピックに分割するかを決定します。"""
+
+    configurable = Configuration.from_runnable_config(config)
+    if configurable.decompose_topic:
+        return "decompose_topic"
+    return "generate_query"
+
+@trace(name="decompose_topic_node")
+def decompose_topic(state: SummaryState, config: RunnableConfig):
+    """リサーチトピックを並列に調査するサブトピックに分割します。"""
+
+    #設定情報（LLMや検索APIの情報）を取り出し
+    configurable = Configuration.from_runnable_config(config)
+
+    #実行全体の期限を設定（サブトピックのサブグラフにも引き継ぐ）
+    deadline_at = get_deadline_at(state, configurable)
+    state.deadline_at = deadline_at
+    budget = get_time_budget(state, configurable)
+
+    #時間がない場合は分割せず、トピックをそのまま1つのサブトピックとして調査する
+    if budget is not None and budget <= 0:
+        return {"subtopics": [state.research_topic], "deadline_at": deadline_at}
+
+    #LLMの設定
+    llm_json_mode = get_chat_model(configurable, configurable.local_llm, timeout=budget, format="json")
+
+    #プロンプトを与えてLLMを実行
+    try:
+        result = llm_json_mode.invoke(
+            build_messages("decompose", configurable.prompt_layout,
+                num_subtopics=configurable.num_subtopics,
+                research_topic=state.research_topic
+            )
+        )
+    except Exception as e:
+        if not is_timeout_error(e):
+            raise
+        return {"subtopics": [state.research_topic], "deadline_at": deadline_at}
+
+    #LLMの出力からサブトピックを取り出す（空や重複は除き、num_subtopics個までにする）
+    try:
+        subtopics = json.loads(result.content).get("subtopics", [])
+    except (json.JSONDecodeError, AttributeError):
+        subtopics = []
+    subtopics = [s.strip() for s in subtopics if isinstance(s, str) and s.strip()]
+    subtopics = list(dict.fromkeys(subtopics))[:configurable.num_subtopics]
+
+    #分割できなかった場合は、トピックをそのまま1つのサブトピックとして調査する
+    if not subtopics:
+        subtopics = [state.research_topic]
+
+    return {"subtopics": subtopics,
+            "deadline_at": deadline_at,
+            "llm_usage": [get_llm_usage(result, "decompose_topic")]}
+
+def continue_to_subtopics(state: SummaryState):
+    """サブトピックごとにresearch_subtopicを並列に実行します。"""
+
+    return [
+        Send("research_subtopic", {"research_topic": subtopic, "deadline_at": state.deadline_at})
+        for subtopic in state.subtopics
+    ]
+
+@trace(name="research_subtopic_node")
+def research_subtopic(state: SummaryState, config: RunnableConfig):
+    """1つのサブトピックについて、検索・要約・振り返りのループをサブグラフとして実行します。"""
+
+    #Sendで渡された値が辞書のまま届いた場合はステートに変換する
+    if isinstance(state, dict):
+        state = SummaryState(**state)
+
+    configurable = Configuration.from_runnable_config(config)
+
+    #サブトピックごとのループ回数をステートで渡してサブグラフを実行
+    #（configurableで渡すと、環境変数MAX_WEB_RESEARCH_LOOPSが設定されている場合にそちらが優先されてしまう）
+    loops = configurable.subtopic_max_loops
+    if loops is None:
+        loops = configurable.max_web_research_loops
+    started = time.perf_counter()
+    result = get_research_loop_graph().invoke(
+        {"research_topic": state.research_topic, "deadline_at": state.deadline_at, "max_loops": loops},
+        config
+    )
+
+    #サブトピックは並列に実行されるため、処理時間はサブトピックごとに計測して結果に含める
+    return {
+        "subtopic_results": [{
+            "research_topic": state.research_topic,
+            "running_summary": result.get("running_summary"),
+            "sources_gathered": result.get("sources_gathered", []),
+            "elapsed": round(time.perf_counter() - started, 3),
+        }],
+        "llm_usage": result.get("llm_usage", []),
+    }
+
+@trace(name="merge_subtopics_node")
+def merge_subtopics(state: SummaryState, config: RunnableConfig):
+    """サブトピックごとの要約と情報源をまとめて、finalize_summaryに渡します。"""
+
+    #サブトピックの順番に並べ直す（並列実行のため終了順は不定）
+    order = {subtopic: i for i, subtopic in enumerate(state.subtopics)}
+    results = sorted(state.subtopic_results, key=lambda r: order.get(r["research_topic"], len(order)))
+
+    #要約はサブトピックごとの見出しを付けて連結する
+    running_summary = "\n\n".join(
+        f"###{r['research_topic']}\n{r['running_summary']}"
+        for r in results if r["running_summary"]
+    )
 
-@traceable(name="finalize_summary_node")
+    #情報源は重複する行を除いて連結する（URL単位の重複はfinalize_summaryで除外する）
+    sources_gathered = list(dict.fromkeys(
+        source for r in results for source in r["sources_gathered"]
+    ))
+
+    return {"running_summary": running_summary,
+            "sources_gathered": sources_gathered}
+
+@trace(name="finalize_summary_node")
 def finalize_summary(state: SummaryState, config: RunnableConfig):
     """最終的なサマリーを作成します"""
 
     seen_urls = set()
     unique_source_lines = []
+    source_urls = []
 
     #sources_gatheredに含まれる各ソースを改行で分割、空行や前後の空白を除外
     for source in state.sources_gathered:
@@ -248,6 +646,7 @@ def finalize_summary(state: SummaryState, config: RunnableConfig):
                     #URLの重複を除外
                     if url not in seen_urls:
                         seen_urls.add(url)#URL
+                        source_urls.append(url)
                         unique_source_lines.append(line_str)#"タイトル:URL"
                 else:
                     #万が一パースできなかった場合は、行全体の重複を排除
@@ -267,53 +666,108 @@ def finalize_summary(state: SummaryState, config: RunnableConfig):
     #設定情報（LLMや検索APIの情報）を取り出し
     configurable = Configuration.from_runnable_config(config)
 
+    #deadlineがある場合は、予備時間を含めた残り時間をすべて使う
+    remaining = state.deadline_at - time.time() if state.deadline_at is not None else None
+    #LLMを使えない場合は、収集済みの要約に情報源を付けて返す
+    fallback_report = f"{state.running_summary or ''}\n\n##情報源\n{all_sources}".strip()
+    if remaining is not None and remaining <= 0:
+        return {"running_summary": fallback_report, "source_urls": source_urls}
+
     #LLMの設定
-    final_llm = ChatOllama(
-        base_url=configurable.ollama_base_url,
-        model=configurable.final_llm,
-        max_tokens=configurable.max_tokens,
-        temperature=0
-    )
+    final_llm = get_chat_model(configurable, configurable.final_llm, timeout=remaining, num_predict=cap_tokens(configurable, remaining))
     
     #プロンプトをLLMに与えて実行
-    result = final_llm.invoke([
-        SystemMessage(content=final_instructions.format(
-            research_topic=state.research_topic
+    try:
+        result = final_llm.invoke(
+            build_messages("final", configurable.prompt_layout,
+                research_topic=state.research_topic,
+                running_summary=state.running_summary,
+                all_sources=all_sources
             )
-        ),
-        HumanMessage(content=final_user.format(
-            research_topic=state.research_topic,
-            running_summary=state.running_summary,
-            all_sources=all_sources
-        ))
-    ])
+        )
+    except Exception as e:
+        if not is_timeout_error(e):
+            raise
+        return {"running_summary": fallback_report, "source_urls": source_urls}
 
     final_report = result.content
 
     #結果をstateに反映
     state.running_summary = final_report
-    return {"running_summary": final_report}
+    return {"running_summary": final_report,
+            "source_urls": source_urls,
+            "llm_usage": [get_llm_usage(result, "finalize_summary")]}
 
     
-#ステートグラフの初期化
-builder = StateGraph(SummaryState, input=SummaryStateInput, output=SummaryStateOutput, config_schema=Configuration)
-
-#グラフにノードを追加
-builder.add_node("generate_query", generate_query)#"ノード名",関数
-builder.add_node("generate_requery", generate_requery)
-builder.add_node("web_research", web_research)
-builder.add_node("summarize_sources", summarize_sources)
-builder.add_node("reflect_on_summary", reflect_on_summary)
-builder.add_node("finalize_summary", finalize_summary)
-
-#グラフにエッジを追加
-builder.add_edge(START, "generate_query")
-builder.add_edge("generate_query", "web_research")
-builder.add_edge("generate_requery", "web_research")
-builder.add_edge("web_research", "summarize_sources")
-builder.add_edge("summarize_sources", "reflect_on_summary")
-builder.add_conditional_edges("reflect_on_summary", route_research)#ループ回数により、generate_requery or finalize_summaryに遷移
-builder.add_edge("finalize_summary", END)
-
-#グラフのコンパイル
-graph = builder.compile()
\ No newline at end of file
+def add_research_loop(builder: StateGraph, exit_node: str):
+    """検索・要約・振り返りのループのノードとエッジを追加します（ループを抜けるとexit_nodeへ進む）。"""
+
+    #グラフにノードを追加（プロファイリングが有効な場合はノードごとにレポートを出力する）
+    builder.add_node("generate_query", profile_node(generate_query))#"ノード名",関数
+    builder.add_node("generate_requery", profile_node(generate_requery))
+    builder.add_node("web_research", profile_node(web_research))
+    builder.add_node("summarize_sources", profile_node(summarize_sources))
+    builder.add_node("reflect_on_summary", profile_node(reflect_on_summary))
+    builder.add_node("plan_research", profile_node(plan_research))
+
+    #グラフにエッジを追加
+    builder.add_edge("generate_query", "web_research")
+    builder.add_edge("generate_requery", "web_research")
+    builder.add_edge("web_research", "summarize_sources")
+    builder.add_conditional_edges("summarize_sources", route_planner)#fused_plannerにより、reflect_on_summary or plan_researchに遷移
+    #ループ回数により、generate_requery or exit_nodeに遷移
+    builder.add_conditional_edges("reflect_on_summary", route_research,
+                                  {"generate_requery": "generate_requery", "finalize_summary": exit_node})
+    #ループ回数により、web_research or exit_nodeに遷移
+    builder.add_conditional_edges("plan_research", route_planned_research,
+                                  {"web_research": "web_research", "finalize_summary": exit_node})
+
+def build_graph():
+    """ステートグラフを構築してコンパイルします。"""
+
+    #ステートグラフの初期化
+    builder = StateGraph(SummaryState, input=SummaryStateInput, output=SummaryStateOutput, config_schema=Configuration)
+
+    #検索ループと最終的なサマリー
+    add_research_loop(builder, "finalize_summary")
+    builder.add_node("finalize_summary", profile_node(finalize_summary))
+    builder.add_edge("finalize_summary", END)
+
+    #サブトピックに分割して並列に調査し、結果をまとめてfinalize_summaryへ進む
+    builder.add_node("decompose_topic", profile_node(decompose_topic))
+    builder.add_node("research_subtopic", profile_node(research_subtopic))
+    builder.add_node("merge_subtopics", profile_node(merge_subtopics))
+    builder.add_conditional_edges("decompose_topic", continue_to_subtopics, ["research_subtopic"])
+    builder.add_edge("research_subtopic", "merge_subtopics")
+    builder.add_edge("merge_subtopics", "finalize_summary")
+
+    #decompose_topicにより、generate_query or decompose_topicから開始
+    builder.add_conditional_edges(START, route_start)
+
+    #グラフのコンパイル（トレースIDを指定せずに呼び出しても、実行ごとに1つのトレースにまとめる）
+    return builder.compile().with_config(callbacks=[run_tree])
+
+def build_research_loop_graph():
+    """サブトピック用に、finalize_summaryを含まない検索ループだけのグラフを構築してコンパイルします。"""
+
+    #出力は要約と情報源を取り出すためにステート全体とする
+    builder = StateGraph(SummaryState, config_schema=Configuration)
+    add_research_loop(builder, END)
+    builder.add_edge(START, "generate_query")
+    return builder.compile().with_config(callbacks=[run_tree])
+
+@lru_cache(maxsize=None)
+def get_research_loop_graph():
+    """コンパイル済みのサブトピック用のグラフを返します。"""
+    return build_research_loop_graph()
+
+@lru_cache(maxsize=None)
+def get_graph():
+    """コンパイル済みのグラフを返します（最初の呼び出しでコンパイルし、以降はキャッシュを使う）。"""
+    return build_graph()
+
+def __getattr__(name: str):
+    #`from deep_research.graph import graph` を、インポート時ではなく最初の参照時にコンパイルする
+    if name == "graph":
+        return get_graph()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,166 @@
+import contextvars
+import cProfile
+import functools
+import io
+import itertools
+import os
+import pstats
+import threading
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+
+#プロファイリングの出力先。Configurationと同じく、環境変数PROFILE_DIRがconfigurableのprofile_dirより優先される
+PROFILE_DIR_ENV = "PROFILE_DIR"
+#tracemallocが記録するスタックの深さ
+TRACEMALLOC_FRAMES = 10
+#レポートに出力する関数・行の数
+REPORT_LIMIT = 25
+
+#プロファイリング中のノードで呼ばれたヘルパーの記録（ノードの外ではNone）
+_helper_records: contextvars.ContextVar[Optional[List[Dict[str, Any]]]] = contextvars.ContextVar(
+    "deep_research_helper_records", default=None
+)
+_report_ids = itertools.count(1)
+#tracemallocはプロセス全体で1つなので、並列に実行されるノードの数を数えて開始・停止する
+#（プロファイリングの前から呼び出し元が計測していた場合は止めない）
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+_tracemalloc_started = False
+
+def get_profile_dir(config: Optional[Dict[str, Any]] = None) -> Optional[str]:
+    """プロファイリングの出力先を返します（無効な場合はNone）。"""
+    configurable = config.get("configurable", {}) if config else {}
+    return os.environ.get(PROFILE_DIR_ENV) or configurable.get("profile_dir")
+
+def _start_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _tracemalloc_started = True
+        _tracemalloc_users += 1
+
+def _stop_tracemalloc():
+    global _tracemalloc_users, _tracemalloc_started
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0 and _tracemalloc_started:
+            tracemalloc.stop()
+            _tracemalloc_started = False
+
+def profile_node(func: Callable) -> Callable:
+    """
+    グラフのノードをCPUプロファイル（cProfile）とメモリ割り当て（tracemalloc）の計測で包みます。
+
+    プロファイリングが無効な場合は、configと環境変数を見るだけでそのままノードを呼び出します。
+    有効な場合は、ノードごとに <プロセスID>_<連番>_<ノード名>.prof（pstats形式）と .txt（要約）を出力先に書き出します。
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(state, config=None, *args, **kwargs):
+        directory = get_profile_dir(config)
+        #サブグラフのノードなど、プロファイリング中のノードの中で呼ばれた場合は外側のレポートに含める
+        if not directory or _helper_records.get() is not None:
+            return func(state, config, *args, **kwargs)
+        return _profile(name, directory, func, (state, config, *args), kwargs)
+
+    return wrapper
+
+def profile_helper(func: Callable) -> Callable:
+    """
+    utils.py のヘルパーを計測対象にします。
+
+    プロファイリング中のノードの中で呼ばれた場合は、呼び出し回数・時間・メモリの増減をノードのレポートにまとめます。
+    ノードの外で呼ばれ、環境変数PROFILE_DIRが設定されている場合は、ヘルパー単独のレポートを書き出します。
+    """
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        records = _helper_records.get()
+        if records is None:
+            directory = os.environ.get(PROFILE_DIR_ENV)
+            if not directory:
+                return func(*args, **kwargs)
+            return _profile(name, directory, func, args, kwargs)
+
+        #ノードのcProfileがすでに動いているため、ここでは軽い計測だけを行う
+        memory_before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            records.append({
+                "name": name,
+                "seconds": time.perf_counter() - started,
+                "memory_delta": tracemalloc.get_traced_memory()[0] - memory_before,
+            })
+
+    return wrapper
+
+def _profile(name: str, directory: str, func: Callable, args: tuple, kwargs: Dict[str, Any]):
+    records: List[Dict[str, Any]] = []
+    token = _helper_records.set(records)
+    _start_tracemalloc()
+    snapshot_before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        #Python 3.12以降では、別のスレッドのプロファイラが動いているとcProfileを開始できない
+        profiler = None
+
+    started = time.perf_counter()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - started
+        if profiler is not None:
+            profiler.disable()
+        peak = tracemalloc.get_traced_memory()[1]
+        snapshot_after = tracemalloc.take_snapshot()
+        _stop_tracemalloc()
+        _helper_records.reset(token)
+        _write_report(directory, name, seconds, peak, profiler, snapshot_before, snapshot_after, records)
+
+def _write_report(directory: str, name: str, seconds: float, peak: int, profiler: Optional[cProfile.Profile],
+                  snapshot_before: tracemalloc.Snapshot, snapshot_after: tracemalloc.Snapshot,
+                  records: List[Dict[str, Any]]):
+    """ノードのプロファイル結果を <プロセスID>_<連番>_<名前>.prof と .txt に書き出します。"""
+    os.makedirs(directory, exist_ok=True)
+    base = os.path.join(directory, f"{os.getpid()}_{next(_report_ids):05d}_{name}")
+
+    lines = [f"{name}: {seconds:.3f}s, peak traced memory {peak / 1024:.1f} KiB", ""]
+
+    if profiler is not None:
+        profiler.dump_stats(base + ".prof")
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(REPORT_LIMIT)
+        lines += ["## CPU (cumulative)", stream.getvalue()]
+    else:
+        lines += ["## CPU", "cProfile was unavailable because another profiler was active.", ""]
+
+    #tracemallocとこのモジュール自身の割り当ては除外する
+    filters = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, __file__)]
+    stats = snapshot_after.filter_traces(filters).compare_to(snapshot_before.filter_traces(filters), "lineno")
+    lines.append("## Allocations (net, by line)")
+    lines += [str(stat) for stat in stats[:REPORT_LIMIT]]
+    lines.append("")
+
+    if records:
+        totals: Dict[str, Dict[str, float]] = {}
+        for record in records:
+            total = totals.setdefault(record["name"], {"calls": 0, "seconds": 0.0, "memory_delta": 0})
+            total["calls"] += 1
+            total["seconds"] += record["seconds"]
+            total["memory_delta"] += record["memory_delta"]
+        lines.append("## Helpers")
+        for helper, total in sorted(totals.items(), key=lambda item: -item[1]["seconds"]):
+            lines.append(f"{helper}: {int(total['calls'])} calls, {total['seconds']:.3f}s, {total['memory_delta'] / 1024:+.1f} KiB")
+
+    with open(base + ".txt", "w", encoding="utf-8") as f:
+        f.write("\n".join(lines) + "\n")
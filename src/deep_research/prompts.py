@@ -1,4 +1,5 @@
 from datetime import datetime
+from langchain_core.messages import HumanMessage, SystemMessage
 
 def get_current_date():
     from datetime import datetime
@@ -33,6 +34,34 @@ Example output:
 回答はJSON形式で提供してください。:
 """
 
+decompose_instructions = """あなたは広いリサーチトピックを、並行して調査できるサブトピックに分割する専門家です。"""
+
+decompose_user = """
+<GOAL>
+RESEARCH TOPICを、互いに重複しない{num_subtopics}個のサブトピックに分割します。
+</GOAL>
+
+<REQUIREMENTS>
+1. 各サブトピックは、それだけでWeb検索と要約ができる具体的な調査テーマにしてください。
+2. サブトピックを合わせると、RESEARCH TOPICの全体を網羅するようにしてください。
+3. 各サブトピックは短い一文にしてください。
+   ###RESEARCH TOPIC:{research_topic}
+</REQUIREMENTS>
+
+<FORMAT>
+以下のキーを含むJSON形式で出力してください:
+- subtopics: サブトピックの文字列のリスト
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{{
+    "subtopics": ["NVIDIA B200 のスペックとベンチマーク", "NVIDIA B200 の価格と保守", "NVIDIA B200 の設置環境とネットワーク"]
+}}
+</EXAMPLE>
+
+回答はJSON形式で提供してください。:"""
+
 summarizer_instructions = """
 あなたはWeb検索結果をもとに、高品質な日本語ドキュメントを作成するアシスタントです。
 """
@@ -71,6 +100,27 @@ Web検索結果に基づいて、ユーザーの関心トピックに関する
 </FORMATTING>
 """
 
+map_instructions = """あなたはWeb検索結果の1つの情報源から要点を抽出するアシスタントです。"""
+
+map_user = """
+<GOAL>
+SOURCEからRESEARCH TOPICに関連する情報だけを抜き出し、短いメモにまとめてください。
+</GOAL>
+
+<REQUIREMENTS>
+1. RESEARCH TOPICに関連する事実、数値、固有名詞を漏らさず残してください。
+2. RESEARCH TOPICに関連しない情報や、ナビゲーション・メニューなどの実質的な内容を含まない文章は省いてください。
+3. 関連する情報がない場合は「関連情報なし」とだけ出力してください。
+   ###RESEARCH TOPIC:{research_topic}
+   ###SOURCE:{source}
+</REQUIREMENTS>
+
+<FORMATTING>
+- 箇条書きで簡潔に記述してください。
+- XMLタグは使わないでください。
+</FORMATTING>
+"""
+
 reflection_instructions = """あなたはトピックに関する要約を分析する専門的なリサーチアシスタントです。"""
 
 reflection_user = """
@@ -129,6 +179,46 @@ LONG QUERYを、WEB検索に適した掛け合わせのキーワードに変換
 </EXAMPLE>
 """
 
+planner_instructions = """あなたはトピックに関する要約を分析し、次のWeb検索を計画する専門的なリサーチアシスタントです。"""
+
+planner_user = """
+<GOAL>
+ドキュメントの不足分を特定し、それを埋めるための質問文と検索キーワードを作成する
+</GOAL>
+
+<REQUIREMENTS>
+1. RESEARCH TOPICに対するDOCUMENTの不足分を特定してください。
+   ###RESEARCH TOPIC:{research_topic}
+   ###DOCUMENT:{running_summary}
+2. DOCUMENTの不足分を埋めるための具体的な質問文を1つ考えてください。
+3. その質問文がPAST QUERYと異なる内容にしてください。
+   ###PAST QUERY:{query_history}
+4. 質問文は一文で短くシンプルにしてください。
+5. 質問文を、WEB検索に適した2キーワード程度の掛け合わせのキーワードに変換してください。
+</REQUIREMENTS>
+
+<FORMAT>
+以下のキーを含むJSON形式で出力してください:
+- knowledge_gap: 足りない、または深掘りが必要な内容の説明
+- follow_up_query: それを調べるための具体的な質問文
+- query: 質問文を変換した短い検索キーワード
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{{
+    "knowledge_gap": "要約にはパフォーマンス評価指標やベンチマークに関する情報が不足している",
+    "follow_up_query": "特定の製品のベンチマークの事例は？",
+    "query": "NVIDIA B200 ベンチマーク"
+}}
+</EXAMPLE>
+
+分析結果はJSON形式で提供してください。:"""
+
+planner_retry_user = """
+前回の出力では次のキーが欠けているか空でした: {missing_fields}
+前回の分析を踏まえて、これらのキーだけを含むJSON形式で出力してください。:"""
+
 final_instructions ="""あなたは詳細で分かりやすいレポートを作成する日本語のアシスタントです。"""
 
 final_user = """
@@ -155,4 +245,291 @@ final_user = """
 <FORMATTING>
 - XMLタグは使わないでください。
 </FORMATTING>
-"""
\ No newline at end of file
+"""
+#以下はOllamaのKVキャッシュを再利用するためのプレフィックス固定版のプロンプト
+#固定の指示はすべてシステムメッセージに置き、可変の内容はユーザーメッセージの末尾に、変化の少ない順に並べる
+
+query_writer_stable_instructions = """あなたは目的に特化したウェブ検索クエリの作成者です。
+
+<GOAL>
+WEB検索用のクエリを作成します。
+</GOAL>
+
+<REQUIREMENTS>
+1.ユーザーが示すRESEARCH TOPICに基づいてウェブ検索用のクエリを生成してください。
+2.ユーザーが示すCURRENT DATEの日付時点での最新情報を考慮してクエリを作成してください。
+</REQUIREMENTS>
+
+<FORMAT>
+以下の2つのキーを含むJSONオブジェクトとして返答してください（キー名は必ず下記の通り）:
+   - "query": 実際の検索クエリ文字列
+   - "rationale": このクエリがなぜ適切かを説明する短い理由
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{
+    "query": "トランスフォーマー アーキテクチャ 解説",
+    "rationale": "トランスフォーマーモデルの基本構造を理解するため"
+}
+</EXAMPLE>
+
+回答はJSON形式で提供してください。"""
+
+query_writer_stable_user = """###RESEARCH TOPIC:{research_topic}
+###CURRENT DATE:{current_date}"""
+
+decompose_stable_instructions = """あなたは広いリサーチトピックを、並行して調査できるサブトピックに分割する専門家です。
+
+<GOAL>
+RESEARCH TOPICを、互いに重複しないNUMBER個のサブトピックに分割します。
+</GOAL>
+
+<REQUIREMENTS>
+1. 各サブトピックは、それだけでWeb検索と要約ができる具体的な調査テーマにしてください。
+2. サブトピックを合わせると、RESEARCH TOPICの全体を網羅するようにしてください。
+3. 各サブトピックは短い一文にしてください。
+</REQUIREMENTS>
+
+<FORMAT>
+以下のキーを含むJSON形式で出力してください:
+- subtopics: サブトピックの文字列のリスト
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{
+    "subtopics": ["NVIDIA B200 のスペックとベンチマーク", "NVIDIA B200 の価格と保守", "NVIDIA B200 の設置環境とネットワーク"]
+}
+</EXAMPLE>
+
+NUMBERとRESEARCH TOPICはユーザーが示します。回答はJSON形式で提供してください。"""
+
+decompose_stable_user = """###NUMBER:{num_subtopics}
+###RESEARCH TOPIC:{research_topic}"""
+
+summarizer_stable_instructions = """あなたはWeb検索結果をもとに、高品質な日本語ドキュメントを作成するアシスタントです。
+
+<GOAL>
+Web検索結果に基づいて、ユーザーの関心トピックに関するドキュメントを作成してください。
+</GOAL>
+
+<REQUIREMENTS>
+1. RESEARCH TOPICに関連する情報をRESEARCH RESULTから抽出して詳しく記述してください。
+2. RESEARCH TOPICに関連しない情報や価値のない冗長な文はRESEARCH RESULTから無視してください。
+3. 実質的な内容を含まない文章（ナビゲーション、言語切り替え、リンク誘導、メニュー情報など）は省いてください。
+4. EXISTING SUMMARYが空でない場合は、EXISTING SUMMARYを残しつつ、RESEARCH RESULTから抽出した情報を追加してください。
+5. EXISTING SUMMARYが空である場合は、RESEARCH RESULTから抽出した情報を追加してください。
+6. カテゴリごとに詳細な文章を作成してください。
+</REQUIREMENTS>
+
+<EXAMPLE>
+###アーキテクチャー
+###スペック
+###ベンチマーク
+###ソフトウェア
+###ネットワーク
+###設置環境
+###コスト
+###保守
+</EXAMPLE>
+
+<FORMATTING>
+- タイトルや説明は不要です。本文から始めてください。
+- XMLタグは使わないでください。
+</FORMATTING>
+
+RESEARCH TOPIC、EXISTING SUMMARY、RESEARCH RESULTはユーザーが示します。"""
+
+summarizer_stable_user = """###RESEARCH TOPIC:{research_topic}
+###EXISTING SUMMARY:{existing_summary}
+###RESEARCH RESULT:{most_recent_web_research}"""
+
+map_stable_instructions = """あなたはWeb検索結果の1つの情報源から要点を抽出するアシスタントです。
+
+<GOAL>
+SOURCEからRESEARCH TOPICに関連する情報だけを抜き出し、短いメモにまとめてください。
+</GOAL>
+
+<REQUIREMENTS>
+1. RESEARCH TOPICに関連する事実、数値、固有名詞を漏らさず残してください。
+2. RESEARCH TOPICに関連しない情報や、ナビゲーション・メニューなどの実質的な内容を含まない文章は省いてください。
+3. 関連する情報がない場合は「関連情報なし」とだけ出力してください。
+</REQUIREMENTS>
+
+<FORMATTING>
+- 箇条書きで簡潔に記述してください。
+- XMLタグは使わないでください。
+</FORMATTING>
+
+RESEARCH TOPICとSOURCEはユーザーが示します。"""
+
+map_stable_user = """###RESEARCH TOPIC:{research_topic}
+###SOURCE:{source}"""
+
+reflection_stable_instructions = """あなたはトピックに関する要約を分析する専門的なリサーチアシスタントです。
+
+<GOAL>
+ドキュメントの不足分を埋める検索クエリ用の質問文を作成する
+</GOAL>
+
+<REQUIREMENTS>
+1. RESEARCH TOPICに対するDOCUMENTの不足分を特定してください。
+2. DOCUMENTの不足分を埋めるための具体的な質問文を1つ考えてください。
+3. その質問文がPAST QUERYと異なる内容にしてください。
+4. 質問文は一文で短くシンプルにしてください。
+</REQUIREMENTS>
+
+<FORMAT>
+以下のキーを含むJSON形式で出力してください:
+- knowledge_gap: 足りない、または深掘りが必要な内容の説明
+- follow_up_query: それを調べるための具体的な検索クエリ
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{
+    "knowledge_gap": "要約にはパフォーマンス評価指標やベンチマークに関する情報が不足している",
+    "follow_up_query": "特定の製品のベンチマークの事例は？"
+}
+</EXAMPLE>
+
+RESEARCH TOPIC、PAST QUERY、DOCUMENTはユーザーが示します。分析結果はJSON形式で提供してください。"""
+
+reflection_stable_user = """###RESEARCH TOPIC:{research_topic}
+###PAST QUERY:{query_history}
+###DOCUMENT:{running_summary}"""
+
+requery_stable_instructions = """あなたは短い検索クエリを生成する専門家です。
+
+<GOAL>
+長文の質問を、WEB検索に適した掛け合わせのキーワードに変換します。
+</GOAL>
+
+<REQUIREMENTS>
+ユーザーが示すLONG QUERYを、WEB検索に適した掛け合わせのキーワードに変換してください。
+</REQUIREMENTS>
+
+<FORMAT>
+1. 出力は必ず JSON 形式で、キー "query" を含めてください。
+2. 2キーワード程度の短いクエリをJSON形式で出力してください
+</FORMAT>
+
+<EXAMPLE>
+{
+  "query": "NVIDIA B200 価格"
+}
+</EXAMPLE>"""
+
+requery_stable_user = """###LONG QUERY:{long_query}"""
+
+planner_stable_instructions = """あなたはトピックに関する要約を分析し、次のWeb検索を計画する専門的なリサーチアシスタントです。
+
+<GOAL>
+ドキュメントの不足分を特定し、それを埋めるための質問文と検索キーワードを作成する
+</GOAL>
+
+<REQUIREMENTS>
+1. RESEARCH TOPICに対するDOCUMENTの不足分を特定してください。
+2. DOCUMENTの不足分を埋めるための具体的な質問文を1つ考えてください。
+3. その質問文がPAST QUERYと異なる内容にしてください。
+4. 質問文は一文で短くシンプルにしてください。
+5. 質問文を、WEB検索に適した2キーワード程度の掛け合わせのキーワードに変換してください。
+</REQUIREMENTS>
+
+<FORMAT>
+以下のキーを含むJSON形式で出力してください:
+- knowledge_gap: 足りない、または深掘りが必要な内容の説明
+- follow_up_query: それを調べるための具体的な質問文
+- query: 質問文を変換した短い検索キーワード
+</FORMAT>
+
+<EXAMPLE>
+Example output:
+{
+    "knowledge_gap": "要約にはパフォーマンス評価指標やベンチマークに関する情報が不足している",
+    "follow_up_query": "特定の製品のベンチマークの事例は？",
+    "query": "NVIDIA B200 ベンチマーク"
+}
+</EXAMPLE>
+
+RESEARCH TOPIC、PAST QUERY、DOCUMENTはユーザーが示します。分析結果はJSON形式で提供してください。"""
+
+planner_stable_user = """###RESEARCH TOPIC:{research_topic}
+###PAST QUERY:{query_history}
+###DOCUMENT:{running_summary}"""
+
+final_stable_instructions = """あなたは詳細で分かりやすいレポートを作成する日本語のアシスタントです。
+
+<GOAL>
+ユーザーが示すDOCUMENTを、RESEARCH TOPICに沿って読みやすい文章になるように編集してください。
+</GOAL>
+
+<FORMAT>
+1. 段落は、トピック、要約、詳細、情報源に分けてください。(トピックの見出しや、情報源の見出しは重複しない)
+2. 要約は、詳細をまとめた内容にしてください。
+3. 詳細は、カテゴリに分けて文章を作成してください。（カテゴリ1、カテゴリ2という単語は出力しない）
+4. 情報源は、文末にSOURCESの内容を記載してください。
+</FORMAT>
+
+<EXAMPLE>
+##トピック:(RESEARCH TOPIC)
+##要約
+##詳細
+##情報源:(SOURCES)
+</EXAMPLE>
+
+<FORMATTING>
+- XMLタグは使わないでください。
+</FORMATTING>"""
+
+final_stable_user = """###RESEARCH TOPIC:{research_topic}
+###SOURCES:
+{all_sources}
+###DOCUMENT:{running_summary}"""
+
+#プロンプト名ごとの（システム、ユーザー）テンプレート
+PROMPTS = {
+    "classic": {
+        "query_writer": (query_writer_instructions, query_writer_user),
+        "decompose": (decompose_instructions, decompose_user),
+        "summarizer": (summarizer_instructions, summarizer_user),
+        "map": (map_instructions, map_user),
+        "reflection": (reflection_instructions, reflection_user),
+        "requery": (requery_instructions, requery_user),
+        "planner": (planner_instructions, planner_user),
+        "final": (final_instructions, final_user),
+    },
+    "prefix_stable": {
+        "query_writer": (query_writer_stable_instructions, query_writer_stable_user),
+        "decompose": (decompose_stable_instructions, decompose_stable_user),
+        "summarizer": (summarizer_stable_instructions, summarizer_stable_user),
+        "map": (map_stable_instructions, map_stable_user),
+        "reflection": (reflection_stable_instructions, reflection_stable_user),
+        "requery": (requery_stable_instructions, requery_stable_user),
+        "planner": (planner_stable_instructions, planner_stable_user),
+        "final": (final_stable_instructions, final_stable_user),
+    },
+}
+
+def build_messages(name: str, layout: str = "classic", **values):
+    """
+    プロンプト名とレイアウトから、LLMに渡すメッセージのリストを組み立てます。
+    
+    prefix_stable のシステムメッセージは固定文なので、そのまま使います。
+    classic のシステムメッセージには可変の値を埋め込みます（final_instructions など）。
+    
+    Args:
+        name (str): プロンプト名（PROMPTS のキー）
+        layout (str): "classic" または "prefix_stable"
+        **values: テンプレートに埋め込む値
+    
+    Returns:
+        list: SystemMessage と HumanMessage のリスト
+    """
+    system_template, user_template = PROMPTS[layout][name]
+    system_content = system_template.format(**values) if layout == "classic" else system_template
+    return [
+        SystemMessage(content=system_content),
+        HumanMessage(content=user_template.format(**values)),
+    ]
@@ -0,0 +1,314 @@
+import argparse
+import asyncio
+import functools
+import json
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager, closing
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from langchain_core.callbacks import BaseCallbackHandler
+from pydantic import BaseModel, Field, field_validator
+
+from deep_research.configuration import Configuration
+from deep_research.graph import get_graph
+
+#ジョブの終了状態
+TERMINAL_STATUSES = ("done", "error", "cancelled")
+
+#HTTPのクライアントがジョブごとに指定できるConfigurationのキー
+#（ollama_base_url や profile_dir などのサーバー側の設定は、任意のURLへの接続や任意のパスへの書き込みにつながるため受け付けない）
+ALLOWED_CONFIGURABLE_KEYS = frozenset({
+    "max_web_research_loops",
+    "deadline_seconds",
+    "summarize_mode",
+    "fused_planner",
+    "decompose_topic",
+    "num_subtopics",
+    "subtopic_max_loops",
+    "fetch_full_page",
+})
+
+class LLMBacklogTracker(BaseCallbackHandler):
+    """実行中のLLM呼び出し数を数えるコールバック（アドミッション制御に使う）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+
+    def _start(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def _end(self):
+        with self._lock:
+            self.in_flight = max(0, self.in_flight - 1)
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._start()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._start()
+
+    def on_llm_end(self, response, **kwargs):
+        self._end()
+
+    def on_llm_error(self, error, **kwargs):
+        self._end()
+
+@dataclass
+class ResearchJob:
+    research_topic: str
+    configurable: Dict[str, Any] = field(default_factory=dict)
+    job_id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    status: str = "queued" #queued / running / cancelling / done / error / cancelled
+    created_at: float = field(default_factory=time.time)
+    running_summary: Optional[str] = None
+    events: List[Dict[str, Any]] = field(default_factory=list) #SSEで配信するイベントの履歴
+    cancel_requested: threading.Event = field(default_factory=threading.Event) #実行中のグラフがノードの区切りで確認する
+    updated: asyncio.Event = field(default_factory=asyncio.Event)
+
+    def emit(self, event: str, **data):
+        """イベントを履歴に追加し、待機中の購読者を起こします。"""
+        self.events.append({"event": event, "job_id": self.job_id, "time": time.time(), **data})
+        self.updated.set()
+        self.updated = asyncio.Event()
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "research_topic": self.research_topic,
+            "status": self.status,
+            "created_at": self.created_at,
+            "running_summary": self.running_summary,
+        }
+
+class JobRejected(Exception):
+    """キューが満杯、またはLLMのバックログが上限を超えているためジョブを受け付けられない"""
+
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+class JobManager:
+    """リサーチジョブのキューと、同時実行数を制限したワーカーを管理します。"""
+
+    def __init__(self, max_concurrency: int = 2, max_queue: int = 32, max_llm_backlog: int = 16, max_finished_jobs: int = 1000):
+        self.max_concurrency = max_concurrency
+        self.max_llm_backlog = max_llm_backlog
+        self.max_finished_jobs = max_finished_jobs
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.jobs: Dict[str, ResearchJob] = {}
+        self.tracker = LLMBacklogTracker()
+        self.running = 0
+        self._workers: List[asyncio.Task] = []
+
+    def start(self):
+        self._workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    async def stop(self):
+        #実行中のグラフは次のノードの区切りで止まる
+        for job in self.jobs.values():
+            job.cancel_requested.set()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+
+    def backlog(self) -> Dict[str, int]:
+        return {
+            "queued": self.queue.qsize(),
+            "running": self.running,
+            "llm_in_flight": self.tracker.in_flight,
+        }
+
+    def submit(self, research_topic: str, configurable: Dict[str, Any]) -> ResearchJob:
+        """ジョブをキューに追加します。受け付けられない場合は JobRejected を送出します。"""
+
+        #実行中のLLM呼び出しと待機中のジョブの合計が上限を超えたら、新規ジョブを断る
+        if self.tracker.in_flight + self.queue.qsize() >= self.max_llm_backlog:
+            raise JobRejected(503, "LLM backlog is full")
+        job = ResearchJob(research_topic=research_topic, configurable=configurable)
+        try:
+            self.queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise JobRejected(429, "Job queue is full")
+        self.jobs[job.job_id] = job
+        job.emit("queued", position=self.queue.qsize())
+        self._prune()
+        return job
+
+    def cancel(self, job_id: str) -> ResearchJob:
+        job = self.jobs[job_id]
+        if job.status == "queued":
+            #キューからは取り出さず、ワーカーが取り出したときにスキップする
+            job.status = "cancelled"
+            job.emit("cancelled")
+        elif job.status == "running":
+            #実行中のノード（LLMや検索の呼び出し）は止められないため、そのノードが終わるまでワーカーの枠を占有したまま待つ
+            job.status = "cancelling"
+            job.cancel_requested.set()
+            job.emit("cancelling")
+        return job
+
+    def _prune(self):
+        """終了済みのジョブが上限を超えたら古いものから削除します。"""
+        finished = [job for job in self.jobs.values() if job.status in TERMINAL_STATUSES]
+        for job in sorted(finished, key=lambda j: j.created_at)[:max(0, len(finished) - self.max_finished_jobs)]:
+            del self.jobs[job.job_id]
+
+    async def _worker(self):
+        while True:
+            job = await self.queue.get()
+            try:
+                if job.status == "cancelled":
+                    continue
+                self.running += 1
+                try:
+                    await self._run(job)
+                finally:
+                    self.running -= 1
+            finally:
+                self.queue.task_done()
+
+    async def _run(self, job: ResearchJob):
+        job.status = "running"
+        job.emit("started")
+        try:
+            #ノードは同期関数のため、グラフはスレッドで実行し、ノードが終わるまで待つ
+            stopped = await asyncio.to_thread(self._run_graph, job, asyncio.get_running_loop())
+        except Exception as e:
+            job.status = "error"
+            job.emit("error", error=f"{type(e).__name__}: {e}")
+            return
+        if stopped:
+            job.status = "cancelled"
+            job.emit("cancelled")
+            return
+        job.status = "done"
+        job.emit("done", running_summary=job.running_summary)
+
+    def _run_graph(self, job: ResearchJob, loop: asyncio.AbstractEventLoop) -> bool:
+        """グラフを実行します（スレッドで呼ばれる）。キャンセルはノードの区切りで反映し、途中で止めた場合はTrueを返す"""
+
+        #トレースIDはジョブIDにして、ジョブのノードを1つのトレースにまとめる
+        config = {"configurable": {"trace_id": job.job_id, **job.configurable}, "callbacks": [self.tracker]}
+        #ノードが終わるたびに、そのノード名とLLMのトークン数を配信する
+        #（途中で止める場合は、closingでストリームを閉じて並列に実行中のノードが終わるのを待つ）
+        with closing(get_graph().stream({"research_topic": job.research_topic}, config, stream_mode="updates")) as chunks:
+            for chunk in chunks:
+                for node, update in chunk.items():
+                    update = update or {}
+                    llm_usage = update.get("llm_usage", [])
+                    loop.call_soon_threadsafe(functools.partial(
+                        job.emit,
+                        "node",
+                        node=node,
+                        input_tokens=sum(u.get("input_tokens") or 0 for u in llm_usage),
+                        output_tokens=sum(u.get("output_tokens") or 0 for u in llm_usage),
+                        research_loop_count=update.get("research_loop_count"),
+                    ))
+                    if node == "finalize_summary":
+                        job.running_summary = update.get("running_summary")
+                if job.cancel_requested.is_set():
+                    return True
+        return False
+
+    async def stream_events(self, job: ResearchJob):
+        """ジョブのイベントを最初から Server-Sent Events 形式で配信します。"""
+        sent = 0
+        while True:
+            updated = job.updated
+            while sent < len(job.events):
+                event = job.events[sent]
+                sent += 1
+                yield f"event: {event['event']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+            if job.status in TERMINAL_STATUSES:
+                return
+            await updated.wait()
+
+class JobRequest(BaseModel):
+    research_topic: str = Field(min_length=1)
+    configurable: Dict[str, Any] = Field(default_factory=dict)
+
+    @field_validator("configurable")
+    @classmethod
+    def check_configurable(cls, value: Dict[str, Any]) -> Dict[str, Any]:
+        """ALLOWED_CONFIGURABLE_KEYS以外のキーを拒否し、値をConfigurationで検証します（不正な場合は422）。"""
+        rejected = sorted(set(value) - ALLOWED_CONFIGURABLE_KEYS)
+        if rejected:
+            raise ValueError(f"configurable keys not allowed: {', '.join(rejected)}")
+        Configuration(**value)
+        return value
+
+def create_app(max_concurrency: int = 2, max_queue: int = 32, max_llm_backlog: int = 16) -> FastAPI:
+    """リサーチジョブを受け付けるHTTPサービスを作成します。"""
+
+    manager = JobManager(max_concurrency=max_concurrency, max_queue=max_queue, max_llm_backlog=max_llm_backlog)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        manager.start()
+        yield
+        await manager.stop()
+
+    app = FastAPI(title="Deep Research", lifespan=lifespan)
+    app.state.manager = manager
+
+    def get_job(job_id: str) -> ResearchJob:
+        job = manager.jobs.get(job_id)
+        if job is None:
+            raise HTTPException(status_code=404, detail="Job not found")
+        return job
+
+    @app.post("/jobs", status_code=202)
+    async def create_job(request: JobRequest):
+        try:
+            job = manager.submit(request.research_topic, request.configurable)
+        except JobRejected as e:
+            raise HTTPException(status_code=e.status_code, detail=e.detail, headers={"Retry-After": "30"})
+        return job.info()
+
+    @app.get("/jobs/{job_id}")
+    async def read_job(job_id: str):
+        return get_job(job_id).info()
+
+    @app.delete("/jobs/{job_id}")
+    async def cancel_job(job_id: str):
+        job = get_job(job_id)
+        manager.cancel(job_id)
+        return job.info()
+
+    @app.get("/jobs/{job_id}/events")
+    async def job_events(job_id: str):
+        job = get_job(job_id)
+        return StreamingResponse(manager.stream_events(job), media_type="text/event-stream")
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", **manager.backlog()}
+
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description="Deep Research HTTP service")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max-concurrency", type=int, default=2, help="同時に実行するジョブ数")
+    parser.add_argument("--max-queue", type=int, default=32, help="待機できるジョブ数")
+    parser.add_argument("--max-llm-backlog", type=int, default=16, help="実行中のLLM呼び出しと待機中のジョブの合計の上限")
+    args = parser.parse_args()
+
+    import uvicorn
+    uvicorn.run(
+        create_app(args.max_concurrency, args.max_queue, args.max_llm_backlog),
+        host=args.host,
+        port=args.port,
+    )
+
+if __name__ == "__main__":
+    main()
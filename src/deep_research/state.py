@@ -1,7 +1,8 @@
 import operator
 from dataclasses import dataclass, field
 from typing_extensions import Annotated
-from typing import List
+from typing import List, Optional
+from pydantic import BaseModel, ConfigDict, Field
 
 @dataclass(kw_only=True)
 class SummaryState:
@@ -13,6 +14,13 @@ class SummaryState:
     running_summary: str = field(default=None) #検索結果の要約
     query_history: List[str] = field(default_factory=list) #質問文の履歴
     short_query_history: List[str] = field(default_factory=list)#検索キーワードの履歴
+    latest_sources: List[str] = field(default_factory=list) #最新の検索結果をソースごとに整形したテキスト
+    llm_usage: Annotated[list, operator.add] = field(default_factory=list) #LLM呼び出しごとのトークン数と処理時間
+    deadline_at: Optional[float] = field(default=None) #実行全体の期限（UNIX時刻）。deadline_secondsから最初のノードで設定
+    subtopics: List[str] = field(default_factory=list) #decompose_topicで分割したサブトピック
+    subtopic_results: Annotated[list, operator.add] = field(default_factory=list) #サブトピックごとの要約と情報源
+    max_loops: Optional[int] = field(default=None) #このステートのループ回数の上限（サブトピック用。環境変数MAX_WEB_RESEARCH_LOOPSより優先）
+    source_urls: List[str] = field(default_factory=list) #finalize_summaryで重複を除いた情報源のURL
 
 #グラフに渡す最初の「入力値」
 @dataclass(kw_only=True)
@@ -22,4 +30,15 @@ class SummaryStateInput:
 #グラフから返ってくる最終的な「出力値」
 @dataclass(kw_only=True)
 class SummaryStateOutput:
-    running_summary: str = field(default=None)
\ No newline at end of file
+    running_summary: str = field(default=None)
+    llm_usage: list = field(default_factory=list) #LLM呼び出しごとのトークン数と処理時間
+    source_urls: List[str] = field(default_factory=list) #重複を除いた情報源のURL（網羅性の比較に使う）
+
+#fused_plannerがLLMに出力させるJSONのスキーマ
+class ResearchPlan(BaseModel):
+    #前後の空白を除いてから検証する（空白だけの値はmin_lengthで弾き、再生成の対象にする）
+    model_config = ConfigDict(str_strip_whitespace=True)
+
+    knowledge_gap: str = Field(min_length=1, description="足りない、または深掘りが必要な内容の説明")
+    follow_up_query: str = Field(min_length=1, description="それを調べるための一文の質問文")
+    query: str = Field(min_length=1, description="WEB検索に適した2キーワード程度の短いクエリ")
\ No newline at end of file
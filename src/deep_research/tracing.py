@@ -0,0 +1,304 @@
+import atexit
+import contextvars
+import dataclasses
+import functools
+import hashlib
+import inspect
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+#トレースの設定は環境変数から読み込む（configure_tracingで実行中に変更できる）
+#TRACE_MODE: off（記録しない）/ local（JSONLに記録）/ langsmith（LangSmithへ送信）/ both
+#未指定の場合は、LangSmithのトレースが有効ならlangsmith、そうでなければoff
+
+def _env_flag(name: str) -> bool:
+    return os.environ.get(name, "").lower() in ("1", "true", "yes")
+
+@dataclasses.dataclass
+class TracingConfig:
+    mode: str = "off"
+    sample_rate: float = 1.0 #トレースを記録する割合（グラフのノードは実行ごと、それ以外はルートのスパンごとに判定）
+    payload: str = "truncate" #入出力の文字列を truncate（先頭だけ残す）または hash（SHA-256と長さ）にする
+    max_payload_chars: int = 200
+    path: str = "traces.jsonl"
+    buffer_size: int = 10000 #リングバッファの大きさ（書き出しが追いつかない場合は古いスパンから捨てる）
+    flush_interval: float = 5.0
+
+    @property
+    def local(self) -> bool:
+        return self.mode in ("local", "both")
+
+    @property
+    def langsmith(self) -> bool:
+        return self.mode in ("langsmith", "both")
+
+    @classmethod
+    def from_env(cls) -> "TracingConfig":
+        default_mode = "langsmith" if _env_flag("LANGSMITH_TRACING") or _env_flag("LANGCHAIN_TRACING_V2") else "off"
+        return cls(
+            mode=os.environ.get("TRACE_MODE", default_mode),
+            sample_rate=float(os.environ.get("TRACE_SAMPLE_RATE", 1.0)),
+            payload=os.environ.get("TRACE_PAYLOAD", "truncate"),
+            max_payload_chars=int(os.environ.get("TRACE_MAX_PAYLOAD_CHARS", 200)),
+            path=os.environ.get("TRACE_PATH", "traces.jsonl"),
+            buffer_size=int(os.environ.get("TRACE_BUFFER_SIZE", 10000)),
+            flush_interval=float(os.environ.get("TRACE_FLUSH_INTERVAL", 5.0)),
+        )
+
+_config = TracingConfig.from_env()
+_buffer: deque = deque(maxlen=_config.buffer_size)
+_flusher: Optional[threading.Thread] = None
+_flusher_lock = threading.Lock()
+_write_lock = threading.Lock()
+
+#実行中のスパン（trace_id, span_id）。記録しないと決まったトレースの中ではNOT_SAMPLED
+NOT_SAMPLED = object()
+_current_span: contextvars.ContextVar[Any] = contextvars.ContextVar("deep_research_current_span", default=None)
+
+def configure_tracing(**kwargs) -> TracingConfig:
+    """トレースの設定を変更します（TracingConfigのフィールドをキーワード引数で指定）。"""
+    global _config, _buffer
+    flush_traces()
+    _config = dataclasses.replace(_config, **kwargs)
+    _buffer = deque(maxlen=_config.buffer_size)
+    return _config
+
+def summarize_payload(value: Any, config: Optional[TracingConfig] = None, depth: int = 0) -> Any:
+    """
+    入出力をトレースに記録できる小さな値に変換します。
+
+    文字列は max_payload_chars で切り詰めるか、SHA-256 のハッシュと長さに置き換えます。
+    辞書・リスト・dataclass は中身を再帰的に変換し、深い入れ子や長いリストは省略します。
+    """
+    config = config or _config
+    if isinstance(value, str):
+        if config.payload == "hash":
+            return f"sha256:{hashlib.sha256(value.encode()).hexdigest()[:16]} len={len(value)}"
+        if len(value) > config.max_payload_chars:
+            return value[:config.max_payload_chars] + f"...[+{len(value) - config.max_payload_chars} chars]"
+        return value
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if depth >= 3:
+        return f"<{type(value).__name__}>"
+    if dataclasses.is_dataclass(value) and not isinstance(value, type):
+        value = {f.name: getattr(value, f.name) for f in dataclasses.fields(value)}
+    if isinstance(value, dict):
+        return {str(k): summarize_payload(v, config, depth + 1) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        items = [summarize_payload(v, config, depth + 1) for v in value[:10]]
+        if len(value) > 10:
+            items.append(f"...[+{len(value) - 10} items]")
+        return items
+    content = getattr(value, "content", None)
+    if isinstance(content, str):
+        return summarize_payload(content, config, depth + 1)
+    return f"<{type(value).__name__}>"
+
+def _ensure_flusher():
+    global _flusher
+    if _flusher is not None:
+        return
+    with _flusher_lock:
+        if _flusher is None:
+            _flusher = threading.Thread(target=_flush_loop, name="deep-research-trace-flusher", daemon=True)
+            _flusher.start()
+
+def _flush_loop():
+    while True:
+        time.sleep(_config.flush_interval)
+        flush_traces()
+
+def flush_traces() -> int:
+    """リングバッファのスパンをJSONLファイルに書き出し、書き出した件数を返します。"""
+    spans = []
+    while True:
+        try:
+            spans.append(_buffer.popleft())
+        except IndexError:
+            break
+    if not spans:
+        return 0
+    with _write_lock:
+        with open(_config.path, "a", encoding="utf-8") as f:
+            for span in spans:
+                f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+    return len(spans)
+
+atexit.register(flush_traces)
+
+class RunTreeTracker(BaseCallbackHandler):
+    """
+    実行中のチェーン（グラフ・ノード）の親子関係を記録するコールバック。
+
+    ノードのconfigに入るコールバックマネージャーはノード自身のrun_idしか持たないため、
+    親をたどってグラフ全体のrun_id（ルート）を求められるようにする。
+    build_graph()でコンパイルしたグラフに付けるため、IDを指定せずに呼び出しても実行ごとのトレースになる。
+    """
+
+    run_inline = True #ノードが始まる前に親子関係を記録する
+    raise_error = False
+
+    def __init__(self):
+        self.parents: Dict[UUID, Optional[UUID]] = {}
+        self._lock = threading.Lock()
+
+    def on_chain_start(self, serialized, inputs, *, run_id: UUID, parent_run_id: Optional[UUID] = None, **kwargs):
+        #トレースしない場合は記録しない
+        if _config.mode == "off":
+            return
+        with self._lock:
+            self.parents[run_id] = parent_run_id
+
+    def on_chain_end(self, outputs, *, run_id: UUID, **kwargs):
+        with self._lock:
+            self.parents.pop(run_id, None)
+
+    def on_chain_error(self, error, *, run_id: UUID, **kwargs):
+        with self._lock:
+            self.parents.pop(run_id, None)
+
+    def root_run_id(self, run_id: Optional[UUID]) -> Optional[UUID]:
+        """run_idから親をたどり、記録されている最も外側のrun_idを返します。"""
+        with self._lock:
+            while run_id in self.parents and self.parents[run_id] is not None:
+                run_id = self.parents[run_id]
+        return run_id
+
+run_tree = RunTreeTracker()
+
+def run_trace_id(config: Any) -> Optional[str]:
+    """
+    RunnableConfigから実行ごとのトレースIDを返します。
+
+    configurableのtrace_id、thread_id、メタデータのthread_idの順に使い、どれもなければ
+    run_treeで求めたグラフ全体のrun_idを使います。
+    LangGraphはノードを1つずつ呼び出すため、ノードの外側にはスパンがありません。
+    同じ実行のノードを1つのトレースにまとめ、サンプリングの判定をそろえるためにこのIDを使います。
+    """
+    if not isinstance(config, dict):
+        return None
+    configurable = config.get("configurable") or {}
+    metadata = config.get("metadata") or {}
+    key = configurable.get("trace_id") or configurable.get("thread_id") or metadata.get("thread_id")
+    if key is None:
+        key = run_tree.root_run_id(getattr(config.get("callbacks"), "parent_run_id", None))
+    return str(key) if key is not None else None
+
+def is_sampled(trace_id: str, sample_rate: float) -> bool:
+    """トレースIDのハッシュでサンプリングを判定します（同じトレースIDなら常に同じ結果）。"""
+    if sample_rate >= 1.0:
+        return True
+    if sample_rate <= 0.0:
+        return False
+    return int(hashlib.sha256(trace_id.encode()).hexdigest()[:8], 16) / 0x100000000 < sample_rate
+
+def _langsmith_wrapper(func: Callable, name: str) -> Callable:
+    """LangSmithに送るための traceable 版の関数（入出力はsummarize_payloadで縮める）"""
+    from langsmith import traceable
+
+    return traceable(
+        name=name,
+        process_inputs=lambda inputs: summarize_payload(inputs),
+        process_outputs=lambda outputs: summarize_payload(outputs),
+    )(func)
+
+def trace(name: Optional[str] = None) -> Callable[[Callable], Callable]:
+    """
+    関数の呼び出しをスパンとして記録するデコレータ（langsmith の @traceable の代わり）。
+
+    TRACE_MODE が off の場合は設定を1回見るだけで関数を呼び出します。
+    記録する場合は、入出力を summarize_payload で縮めてリングバッファに追加し、
+    バックグラウンドのスレッドが一定間隔でJSONLに書き出します。
+    トレースIDとサンプリングはトレースのルートで決まり、その中で呼ばれた関数は同じ判定に従います。
+    ルートの関数が config（RunnableConfig）を受け取る場合は run_trace_id で実行ごとに決まるため、
+    同じ実行のノードは1つのトレースにまとまり、まとめて記録されるか、まとめて捨てられます。
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or func.__name__
+        parameters = list(inspect.signature(func).parameters)
+        config_index = parameters.index("config") if "config" in parameters else None
+        langsmith_func = None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            nonlocal langsmith_func
+            config = _config
+            if config.mode == "off":
+                return func(*args, **kwargs)
+
+            parent = _current_span.get()
+            if parent is NOT_SAMPLED:
+                return func(*args, **kwargs)
+            if parent is None:
+                run_config = kwargs.get("config")
+                if run_config is None and config_index is not None and config_index < len(args):
+                    run_config = args[config_index]
+                #実行ごとのIDがない場合（ノードの外で呼ばれた関数など）は呼び出しごとに判定し、新しいトレースにする
+                trace_id = run_trace_id(run_config)
+                if trace_id is not None:
+                    sampled = is_sampled(trace_id, config.sample_rate)
+                else:
+                    sampled = random.random() < config.sample_rate
+                if not sampled:
+                    token = _current_span.set(NOT_SAMPLED)
+                    try:
+                        return func(*args, **kwargs)
+                    finally:
+                        _current_span.reset(token)
+                trace_id = trace_id or uuid.uuid4().hex
+                parent_id = None
+            else:
+                trace_id, parent_id = parent
+
+            call = func
+            if config.langsmith:
+                if langsmith_func is None:
+                    langsmith_func = _langsmith_wrapper(func, span_name)
+                call = langsmith_func
+
+            span_id = uuid.uuid4().hex[:16]
+            token = _current_span.set((trace_id, span_id))
+            if not config.local:
+                try:
+                    return call(*args, **kwargs)
+                finally:
+                    _current_span.reset(token)
+
+            span = {
+                "trace_id": trace_id,
+                "span_id": span_id,
+                "parent_id": parent_id,
+                "name": span_name,
+                "start": time.time(),
+            }
+            started = time.perf_counter()
+            try:
+                output = call(*args, **kwargs)
+                span["output"] = summarize_payload(output, config)
+                return output
+            except Exception as e:
+                span["error"] = f"{type(e).__name__}: {e}"
+                raise
+            finally:
+                _current_span.reset(token)
+                span["duration_ms"] = (time.perf_counter() - started) * 1000
+                #RunnableConfigはコールバックなどを含むため記録しない
+                inputs = dict(zip(parameters, args))
+                inputs.update(kwargs)
+                inputs.pop("config", None)
+                span["inputs"] = summarize_payload(inputs, config)
+                _buffer.append(span)
+                _ensure_flusher()
+
+        return wrapper
+    return decorator
@@ -1,12 +1,14 @@
 import os
-import httpx
-import requests
-from typing import Dict, Any, List, Union, Optional
+import time
+from typing import Dict, Any, List, Union, Optional, Callable
 
-from markdownify import markdownify
-from langsmith import traceable
-from tavily import TavilyClient
-from duckduckgo_search import DDGS
+from deep_research.tracing import trace
+
+from deep_research.configuration import SearchAPI
+from deep_research.profiling import profile_helper
+
+#検索バックエンドの外部ライブラリ（httpx, requests, markdownify, tavily, duckduckgo_search）は、
+#起動を速くするため、使われるときに各関数の中でインポートする
 
 def get_config_value(value: Any) -> str:
     """
@@ -26,6 +28,7 @@ def get_config_value(value: Any) -> str:
     """
     return value if isinstance(value, str) else value.value
 
+@profile_helper
 def strip_thinking_tokens(text: str) -> str:
     """
     <think>〜</think> タグとその中身をテキストから削除します。
@@ -44,26 +47,20 @@ def strip_thinking_tokens(text: str) -> str:
         text = text[:start] + text[end:]
     return text
 
-def deduplicate_and_format_sources(
-    search_response: Union[Dict[str, Any], List[Dict[str, Any]]], 
-    max_tokens_per_source: int, 
-    fetch_full_page: bool = False
-) -> str:
+@profile_helper
+def deduplicate_sources(
+    search_response: Union[Dict[str, Any], List[Dict[str, Any]]]
+) -> List[Dict[str, Any]]:
     """
-    検索APIからの検索結果を整形＆重複除去します。
-    
-    単一の検索結果または検索結果のリストを受け取り、
-    URLをキーとして重複を除去し、構造化されたテキスト形式に整形します。
+    検索APIからの検索結果をURLをキーとして重複除去します。
     
     Args:
         search_response (dict または list): 以下のいずれか
             - 'results'キーを含む辞書
             - 辞書のリスト（各辞書が検索結果を含む）
-        max_tokens_per_source (int): 各ソースごとの最大トークン数（目安：1トークン ≒ 4文字）
-        fetch_full_page (bool, optional): ページ全文を含めるかどうか（デフォルトは False）
     
     Returns:
-        str: 整形済みで重複のないソース情報を含む文字列
+        list: 重複のない検索結果の辞書リスト（出現順）
     
     Raises:
         ValueError: 入力が 'results' キーを持つ辞書でも、検索結果リストでもない場合
@@ -85,26 +82,71 @@ def deduplicate_and_format_sources(
     for source in sources_list:
         if source['url'] not in unique_sources:
             unique_sources[source['url']] = source
+    return list(unique_sources.values())
+
+@profile_helper
+def format_source(source: Dict[str, Any], max_tokens_per_source: int, fetch_full_page: bool = False) -> str:
+    """
+    1件の検索結果を構造化されたテキスト形式に整形します。
     
-    formatted_text = "Sources:\n\n"
-    for i, source in enumerate(unique_sources.values(), 1):
-        formatted_text += f"Source: {source['title']}\n===\n"
-        formatted_text += f"URL: {source['url']}\n===\n"
-        formatted_text += f"Most relevant content from source: {source['content']}\n===\n"
-        if fetch_full_page:
-            # Using rough estimate of 4 characters per token
-            char_limit = max_tokens_per_source * 4
-            # Handle None raw_content
-            raw_content = source.get('raw_content', '')
-            if raw_content is None:
-                raw_content = ''
-                print(f"Warning: No raw_content found for source {source['url']}")
-            if len(raw_content) > char_limit:
-                raw_content = raw_content[:char_limit] + "... [truncated]"
-            formatted_text += f"Full source content limited to {max_tokens_per_source} tokens: {raw_content}\n\n"
-                
-    return formatted_text.strip()
+    Args:
+        source (dict): title, url, content, raw_content を持つ検索結果
+        max_tokens_per_source (int): ソースの最大トークン数（目安：1トークン ≒ 4文字）
+        fetch_full_page (bool, optional): ページ全文を含めるかどうか（デフォルトは False）
+    
+    Returns:
+        str: 整形済みのソース情報
+    """
+    parts = [
+        f"Source: {source['title']}\n===\n",
+        f"URL: {source['url']}\n===\n",
+        f"Most relevant content from source: {source['content']}\n===\n",
+    ]
+    if fetch_full_page:
+        # Using rough estimate of 4 characters per token
+        char_limit = max_tokens_per_source * 4
+        # Handle None raw_content
+        raw_content = source.get('raw_content', '')
+        if raw_content is None:
+            raw_content = ''
+            print(f"Warning: No raw_content found for source {source['url']}")
+        if len(raw_content) > char_limit:
+            raw_content = raw_content[:char_limit] + "... [truncated]"
+        parts.append(f"Full source content limited to {max_tokens_per_source} tokens: {raw_content}\n\n")
+    return "".join(parts)
+
+@profile_helper
+def deduplicate_and_format_sources(
+    search_response: Union[Dict[str, Any], List[Dict[str, Any]]], 
+    max_tokens_per_source: int, 
+    fetch_full_page: bool = False
+) -> str:
+    """
+    検索APIからの検索結果を整形＆重複除去します。
+    
+    単一の検索結果または検索結果のリストを受け取り、
+    URLをキーとして重複を除去し、構造化されたテキスト形式に整形します。
+    
+    Args:
+        search_response (dict または list): 以下のいずれか
+            - 'results'キーを含む辞書
+            - 辞書のリスト（各辞書が検索結果を含む）
+        max_tokens_per_source (int): 各ソースごとの最大トークン数（目安：1トークン ≒ 4文字）
+        fetch_full_page (bool, optional): ページ全文を含めるかどうか（デフォルトは False）
+    
+    Returns:
+        str: 整形済みで重複のないソース情報を含む文字列
+    
+    Raises:
+        ValueError: 入力が 'results' キーを持つ辞書でも、検索結果リストでもない場合
+    """
+    formatted_sources = [
+        format_source(source, max_tokens_per_source, fetch_full_page)
+        for source in deduplicate_sources(search_response)
+    ]
+    return ("Sources:\n\n" + "".join(formatted_sources)).strip()
 
+@profile_helper
 def format_sources(search_results: Dict[str, Any]) -> str:
     """
     検索結果をタイトル＋URLの箇条書きリストに整形します。
@@ -122,21 +164,93 @@ def format_sources(search_results: Dict[str, Any]) -> str:
         for source in search_results['results']
     )
 
-def fetch_raw_content(url: str) -> Optional[str]:
+def get_llm_usage(message: Any, node: str) -> Dict[str, Any]:
+    """
+    LLMの応答メッセージからトークン数と処理時間を取り出します。
+    
+    トークン数は usage_metadata から、処理時間は Ollama の response_metadata
+    （*_duration はナノ秒）から取得し、ミリ秒に変換します。
+    
+    Args:
+        message: ChatOllama が返した AIMessage
+        node (str): 呼び出し元のノード名
+    
+    Returns:
+        dict: node, model, input_tokens, output_tokens, prompt_eval_ms, eval_ms, total_ms を含む辞書
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    metadata = getattr(message, "response_metadata", None) or {}
+
+    def to_ms(key: str) -> Optional[float]:
+        value = metadata.get(key)
+        return value / 1e6 if value is not None else None
+
+    return {
+        "node": node,
+        "model": metadata.get("model"),
+        "input_tokens": usage.get("input_tokens", metadata.get("prompt_eval_count")),
+        "output_tokens": usage.get("output_tokens", metadata.get("eval_count")),
+        "prompt_eval_ms": to_ms("prompt_eval_duration"),
+        "eval_ms": to_ms("eval_duration"),
+        "total_ms": to_ms("total_duration"),
+    }
+
+def summarize_llm_usage(llm_usage: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+    """
+    get_llm_usage で記録した値をノードごとに集計します。
+    
+    prompt_eval_ms や input_tokens（Ollama の prompt_eval_count）は、KVキャッシュが再利用されると小さくなるため、
+    プロンプトのレイアウト変更の前後比較に使えます。
+    
+    Args:
+        llm_usage (list): get_llm_usage が返した辞書のリスト
+    
+    Returns:
+        dict: ノード名をキーとし、calls と各数値の合計を値とする辞書
+    """
+    totals: Dict[str, Dict[str, float]] = {}
+    for usage in llm_usage:
+        node_totals = totals.setdefault(usage["node"], {"calls": 0})
+        node_totals["calls"] += 1
+        for key in ("input_tokens", "output_tokens", "prompt_eval_ms", "eval_ms", "total_ms"):
+            node_totals[key] = node_totals.get(key, 0) + (usage.get(key) or 0)
+    return totals
+
+def is_timeout_error(error: BaseException) -> bool:
+    """
+    例外がHTTPクライアントのタイムアウトかどうかを判定します。
+    
+    Args:
+        error (BaseException): 判定対象の例外
+    
+    Returns:
+        bool: httpx または requests のタイムアウト、もしくは TimeoutError の場合 True
+    """
+    import httpx
+    import requests
+
+    return isinstance(error, (httpx.TimeoutException, requests.Timeout, TimeoutError))
+
+@profile_helper
+def fetch_raw_content(url: str, timeout: float = 10.0) -> Optional[str]:
     """
     指定したURLからHTMLコンテンツを取得し、Markdown形式に変換します。
     
-    10秒のタイムアウトを設定し、遅いサイトや大容量ページでのフリーズを防ぎます。
+    タイムアウト（デフォルトは10秒）を設定し、遅いサイトや大容量ページでのフリーズを防ぎます。
     
     Args:
     url (str): コンテンツを取得する対象のURL
+    timeout (float, optional): タイムアウト秒数
     
     Returns:
     Optional[str]: Markdown形式で整形されたコンテンツ（成功時）、取得や変換に失敗した場合は None
     """
 
+    import httpx
+    from markdownify import markdownify
+
     try:                
-        with httpx.Client(timeout=10.0) as client:
+        with httpx.Client(timeout=timeout) as client:
             response = client.get(url)
             response.raise_for_status()
             return markdownify(response.text)
@@ -144,12 +258,14 @@ def fetch_raw_content(url: str) -> Optional[str]:
         print(f"Warning: Failed to fetch full page content for {url}: {str(e)}")
         return None
 
-@traceable
+@trace()
+@profile_helper
 def duckduckgo_search(query: str, 
                       max_results: int = 3, 
                       fetch_full_page: bool = False,
                       region: str = 'jp-jp', 
-                      safesearch: str = 'moderate') -> Dict[str, List[Dict[str, Any]]]:
+                      safesearch: str = 'moderate',
+                      timeout: float = 10.0) -> Dict[str, List[Dict[str, Any]]]:
     """
     DuckDuckGoを使ってウェブ検索を実行し、結果を整形して返します。
     
@@ -159,6 +275,7 @@ def duckduckgo_search(query: str,
         query (str): 実行する検索クエリ
         max_results (int, optional): 取得する最大検索件数（デフォルトは3）
         fetch_full_page (bool, optional): 各URLからページ全文を取得するかどうか（デフォルトは False）
+        timeout (float, optional): 検索とページ取得の全体で使える秒数（デフォルトは10秒）
     
     Returns:
         dict: 以下を含む辞書
@@ -168,8 +285,12 @@ def duckduckgo_search(query: str,
                 - content (str): ページ内容の要約・スニペット
                 - raw_content (str or None): ページ全文（`fetch_full_page=True`のとき）
     """
+    from duckduckgo_search import DDGS
+
+    #検索とすべてのページ取得で1つの期限を共有する（ページ取得には残り時間だけを渡す）
+    deadline = time.monotonic() + timeout
     try:
-        with DDGS() as ddgs:
+        with DDGS(timeout=timeout) as ddgs:
             results = []
             search_results = list(ddgs.text(query,
                                             max_results=max_results,
@@ -187,8 +308,9 @@ def duckduckgo_search(query: str,
                     continue
 
                 raw_content = content
-                if fetch_full_page:
-                    raw_content = fetch_raw_content(url)
+                remaining = deadline - time.monotonic()
+                if fetch_full_page and remaining > 0:
+                    raw_content = fetch_raw_content(url, timeout=remaining)
                 
                 result = {
                     "title": title,
@@ -204,8 +326,9 @@ def duckduckgo_search(query: str,
         print(f"Full error details: {type(e).__name__}")
         return {"results": []}
     
-@traceable
-def tavily_search(query: str, fetch_full_page: bool = True, max_results: int = 3) -> Dict[str, List[Dict[str, Any]]]:
+@trace()
+@profile_helper
+def tavily_search(query: str, fetch_full_page: bool = True, max_results: int = 3, timeout: float = 60.0) -> Dict[str, List[Dict[str, Any]]]:
     """
     Tavily APIを使ってウェブ検索を実行し、結果を整形して返します。
     
@@ -215,19 +338,23 @@ def tavily_search(query: str, fetch_full_page: bool = True, max_results: int = 3
         query (str): 実行する検索クエリ
         fetch_full_page (bool, optional): ページ全文を含めるかどうか（デフォルトは True）
         max_results (int, optional): 最大取得件数（デフォルトは3）
+        timeout (float, optional): タイムアウト秒数（デフォルトは60秒）
     
     Returns:
         dict: 以下を含む辞書
             - results (list): 検索結果の辞書リスト（title, url, content, raw_content）
     """
+    from tavily import TavilyClient
      
     tavily_client = TavilyClient()
     return tavily_client.search(query, 
                          max_results=max_results, 
-                         include_raw_content=fetch_full_page)
+                         include_raw_content=fetch_full_page,
+                         timeout=max(1, int(timeout)))
 
-@traceable
-def perplexity_search(query: str, perplexity_search_loop_count: int = 0) -> Dict[str, Any]:
+@trace()
+@profile_helper
+def perplexity_search(query: str, perplexity_search_loop_count: int = 0, timeout: float = 60.0) -> Dict[str, Any]:
     """
     Perplexity APIを使用してウェブ検索を実行し、結果を整形して返します。
     
@@ -237,6 +364,7 @@ def perplexity_search(query: str, perplexity_search_loop_count: int = 0) -> Dict
     Args:
         query (str): 検索クエリ
         perplexity_search_loop_count (int, optional): ループカウント（ソース番号表示用）
+        timeout (float, optional): タイムアウト秒数（デフォルトは60秒）
     
     Returns:
         dict: 以下を含む辞書
@@ -250,6 +378,8 @@ def perplexity_search(query: str, perplexity_search_loop_count: int = 0) -> Dict
         HTTPError: APIリクエストに失敗した場合
     """
 
+    import requests
+
     headers = {
         "accept": "application/json",
         "content-type": "application/json",
@@ -273,7 +403,8 @@ def perplexity_search(query: str, perplexity_search_loop_count: int = 0) -> Dict
     response = requests.post(
         "https://api.perplexity.ai/chat/completions",
         headers=headers,
-        json=payload
+        json=payload,
+        timeout=timeout
     )
     response.raise_for_status() 
     
@@ -297,4 +428,56 @@ def perplexity_search(query: str, perplexity_search_loop_count: int = 0) -> Dict
             "raw_content": None
         })
     
-    return {"results": results}
\ No newline at end of file
+    return {"results": results}
+
+#SearchAPIごとの検索バックエンド
+SEARCH_BACKENDS: Dict[SearchAPI, Callable[..., Dict[str, Any]]] = {}
+
+def register_search_backend(search_api: SearchAPI):
+    """検索バックエンドを SEARCH_BACKENDS に登録するデコレータ"""
+    def decorator(func):
+        SEARCH_BACKENDS[search_api] = func
+        return func
+    return decorator
+
+def get_search_backend(search_api: Union[str, SearchAPI]) -> Callable[..., Dict[str, Any]]:
+    """
+    設定された検索APIに対応する検索バックエンドを返します。
+    
+    バックエンドは query, fetch_full_page, research_loop_count, max_results, timeout を受け取り、
+    'results' キーを持つ辞書を返します。max_results と timeout が None の場合は各バックエンドの既定値を使います。
+    
+    Args:
+        search_api (str または SearchAPI): 検索APIの名前
+    
+    Returns:
+        Callable: 検索バックエンド
+    
+    Raises:
+        ValueError: 登録されていない検索APIの場合
+    """
+    try:
+        return SEARCH_BACKENDS[SearchAPI(get_config_value(search_api))]
+    except (ValueError, KeyError):
+        raise ValueError(f"Unsupported search API: {search_api}")
+
+@register_search_backend(SearchAPI.TAVILY)
+def _tavily_backend(query: str, fetch_full_page: bool, research_loop_count: int,
+                    max_results: Optional[int] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+    return tavily_search(query, fetch_full_page=fetch_full_page, max_results=max_results or 2,
+                         timeout=min(timeout, 60.0) if timeout is not None else 60.0)
+
+@register_search_backend(SearchAPI.PERPLEXITY)
+def _perplexity_backend(query: str, fetch_full_page: bool, research_loop_count: int,
+                        max_results: Optional[int] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+    results = perplexity_search(query, research_loop_count,
+                                timeout=min(timeout, 60.0) if timeout is not None else 60.0)
+    if max_results is not None:
+        results["results"] = results["results"][:max_results]
+    return results
+
+@register_search_backend(SearchAPI.DUCKDUCKGO)
+def _duckduckgo_backend(query: str, fetch_full_page: bool, research_loop_count: int,
+                        max_results: Optional[int] = None, timeout: Optional[float] = None) -> Dict[str, Any]:
+    return duckduckgo_search(query, max_results=max_results or 3, fetch_full_page=fetch_full_page,
+                             timeout=min(timeout, 10.0) if timeout is not None else 10.0)
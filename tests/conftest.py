@@ -0,0 +1,103 @@
+import os
+import sys
+import time
+from typing import Any, Optional
+
+import httpx
+import pytest
+import requests
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+#src/ をインポートパスに追加する（パッケージとしてインストールしていなくてもテストできるようにする）
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from deep_research import graph  # noqa: E402
+from deep_research.configuration import Configuration, SearchAPI  # noqa: E402
+from deep_research.utils import SEARCH_BACKENDS  # noqa: E402
+
+#どのノードのJSONモードでも使える応答（要約や最終レポートにはこの文字列がそのまま入る）
+FAKE_RESPONSE = (
+    '{"query": "stub query", "follow_up_query": "stub follow up", '
+    '"knowledge_gap": "stub gap", "subtopics": ["stub subtopic"]}'
+)
+
+class FakeChatModel(BaseChatModel):
+    """Ollamaの代わりに、指定した時間だけ待って固定の応答を返すチャットモデル"""
+
+    content: str = FAKE_RESPONSE
+    delay: float = 0.0
+    timeout: Optional[float] = None #get_chat_modelに渡されたHTTPクライアントのタイムアウト
+    prompts: Any = None #受け取ったプロンプトを追加するリスト（Noneの場合は記録しない）
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.prompts is not None:
+            self.prompts.append("\n".join(str(message.content) for message in messages))
+        #ChatOllamaと同じく、タイムアウトを超える場合はhttpxのタイムアウトを送出する
+        if self.timeout is not None and self.delay > self.timeout:
+            time.sleep(self.timeout)
+            raise httpx.ReadTimeout("fake LLM timed out")
+        time.sleep(self.delay)
+        message = AIMessage(
+            content=self.content,
+            usage_metadata={"input_tokens": 10, "output_tokens": 5, "total_tokens": 15},
+        )
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+@pytest.fixture(autouse=True)
+def clean_env(monkeypatch):
+    """環境変数はconfigurableより優先されるため、テスト中はConfigurationの環境変数を外す"""
+    for name in Configuration.model_fields:
+        monkeypatch.delenv(name.upper(), raising=False)
+    monkeypatch.delenv("PROFILE_DIR", raising=False)
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """
+    graph.get_chat_modelをFakeChatModelに置き換えます。
+
+    返した辞書のdelayで応答時間、contentで応答を変えられる。responsesにリストを入れると、作成されるモデルごとに先頭から順に応答する。
+    get_chat_modelに渡されたキーワード引数（formatなど）はmodel_kwargsに、プロンプトはpromptsに記録される。
+    """
+    settings = {"delay": 0.0, "content": FAKE_RESPONSE, "responses": [], "model_kwargs": [], "prompts": []}
+
+    def get_chat_model(configurable, model, timeout=None, **kwargs):
+        settings["model_kwargs"].append(kwargs)
+        content = settings["responses"].pop(0) if settings["responses"] else settings["content"]
+        return FakeChatModel(timeout=timeout, delay=settings["delay"], content=content, prompts=settings["prompts"])
+
+    monkeypatch.setattr(graph, "get_chat_model", get_chat_model)
+    return settings
+
+@pytest.fixture
+def fake_search(monkeypatch):
+    """
+    すべての検索APIを固定の結果を返すスタブに置き換えます。
+
+    delayがtimeoutを超えるとtimeoutだけ待ってから、呼び出し回数がfail_afterを超えるとすぐに、requestsのタイムアウトを送出する。
+    """
+    settings = {"delay": 0.0, "calls": 0, "fail_after": None}
+
+    def search(query, fetch_full_page, research_loop_count, max_results=None, timeout=None):
+        settings["calls"] += 1
+        if settings["fail_after"] is not None and settings["calls"] > settings["fail_after"]:
+            raise requests.exceptions.ReadTimeout("fake search timed out")
+        if timeout is not None and settings["delay"] > timeout:
+            time.sleep(max(timeout, 0))
+            raise requests.exceptions.ReadTimeout("fake search timed out")
+        time.sleep(settings["delay"])
+        return {"results": [{
+            "title": f"Result for {query}",
+            "url": f"https://example.com/{research_loop_count}",
+            "content": f"Snippet about {query}",
+            "raw_content": f"Page about {query}",
+        }]}
+
+    for search_api in SearchAPI:
+        monkeypatch.setitem(SEARCH_BACKENDS, search_api, search)
+    return settings
@@ -0,0 +1,37 @@
+import json
+
+from deep_research.batch import read_finished, run_batch
+
+CONFIGURABLE = {"max_web_research_loops": 0}
+
+def write_topics(path, topics):
+    path.write_text("".join(json.dumps({"id": t, "research_topic": t}) + "\n" for t in topics), encoding="utf-8")
+
+def test_run_batch_writes_results(tmp_path, fake_llm, fake_search):
+    topics, output = tmp_path / "topics.jsonl", tmp_path / "results.jsonl"
+    write_topics(topics, ["A", "B", "C"])
+
+    done, failed, _ = run_batch(str(topics), str(output), workers=2, configurable=CONFIGURABLE)
+
+    assert (done, failed) == (3, 0)
+    results = [json.loads(line) for line in output.read_text(encoding="utf-8").splitlines()]
+    assert sorted(r["key"] for r in results) == ["A", "B", "C"]
+    assert all(r["running_summary"] for r in results)
+
+def test_resume_after_partial_line(tmp_path, fake_llm, fake_search):
+    topics, output = tmp_path / "topics.jsonl", tmp_path / "results.jsonl"
+    write_topics(topics, ["A", "B", "C"])
+    #Aは完了済み、Bの書き込み中に中断された出力ファイル
+    finished = json.dumps({"key": "A", "research_topic": "A", "status": "done"})
+    output.write_text(finished + "\n" + '{"key": "B", "research_to', encoding="utf-8")
+
+    done, failed, _ = run_batch(str(topics), str(output), workers=1, configurable=CONFIGURABLE)
+
+    assert (done, failed) == (2, 0)
+    assert read_finished(str(output)) == {"A", "B", "C"}
+    lines = output.read_text(encoding="utf-8").splitlines()
+    assert lines[1] == '{"key": "B", "research_to'
+    assert all(json.loads(line)["status"] == "done" for line in lines[2:])
+
+    #再実行しても完了済みのトピックは実行しない
+    assert run_batch(str(topics), str(output), workers=1, configurable=CONFIGURABLE)[:2] == (0, 0)
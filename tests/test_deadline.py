@@ -0,0 +1,114 @@
+import sys
+import time
+import types
+
+from deep_research import utils
+from deep_research.graph import get_graph, summarize_sources
+from deep_research.state import SummaryState
+
+#ノードの切り替えやスレッドの起動にかかる時間の許容幅（秒）
+SLACK = 0.5
+
+def run(deadline_seconds: float, **configurable):
+    started = time.monotonic()
+    result = get_graph().invoke(
+        {"research_topic": "テスト"},
+        {"configurable": {"deadline_seconds": deadline_seconds, **configurable}},
+    )
+    return result, time.monotonic() - started
+
+def test_slow_llm_finishes_within_deadline(fake_llm, fake_search):
+    #すべてのLLM呼び出しが期限より遅い
+    fake_llm["delay"] = 30.0
+
+    result, elapsed = run(3.0, deadline_reserve_seconds=1.0)
+
+    assert elapsed < 3.0 + SLACK
+    #finalize_summaryもタイムアウトするため、収集済みの内容と情報源がそのままレポートになる
+    assert "##情報源" in result["running_summary"]
+
+def test_search_timeout_finishes_within_deadline(fake_llm, fake_search):
+    #検索が期限より遅く、requestsのタイムアウトを送出する
+    fake_search["delay"] = 30.0
+
+    result, elapsed = run(3.0, deadline_reserve_seconds=1.0)
+
+    assert fake_search["calls"] == 1
+    assert elapsed < 3.0 + SLACK
+    assert result["running_summary"]
+
+def test_runs_finish_within_deadline_with_many_loops(fake_llm, fake_search):
+    fake_llm["delay"] = 0.3
+    fake_search["delay"] = 0.2
+
+    result, elapsed = run(3.0, deadline_reserve_seconds=0.5, max_web_research_loops=100)
+
+    assert elapsed < 3.0 + SLACK
+    assert result["running_summary"]
+
+def test_search_timeout_after_a_successful_loop_is_not_summarized_again(fake_llm, fake_search):
+    #1回目の検索は成功し、2回目以降はタイムアウトする
+    fake_search["fail_after"] = 1
+
+    result, _ = run(30.0, deadline_reserve_seconds=1.0, max_web_research_loops=3)
+
+    assert fake_search["calls"] == 4
+    #1回目の検索結果を含むプロンプトで要約されるのは1回だけ
+    summarizer_prompts = [p for p in fake_llm["prompts"] if "Snippet about" in p]
+    assert len(summarizer_prompts) == 1
+    assert result["running_summary"]
+
+def test_short_deadline_still_searches(fake_llm, fake_search):
+    #deadline_secondsがdeadline_reserve_secondsより短くても、予備時間は一部に抑えられ検索が行われる
+    result, elapsed = run(45.0, deadline_reserve_seconds=60.0)
+
+    assert fake_search["calls"] >= 1
+    assert "summarize_sources" in {u["node"] for u in result["llm_usage"]}
+    assert elapsed < 45.0
+
+def test_summarize_keeps_existing_summary_when_short_on_time(fake_llm):
+    fake_llm["content"] = "truncated"
+    existing = "既存の要約" * 100
+    state = SummaryState(
+        research_topic="テスト",
+        running_summary=existing,
+        web_research_results=["新しい検索結果"],
+        deadline_at=time.time() + 3.0,
+    )
+
+    #残り2秒では既存の要約を書き直せないため、LLMを呼ばずに追記する
+    result = summarize_sources(state, {"configurable": {"deadline_reserve_seconds": 1.0}})
+
+    assert result["running_summary"] == existing + "\n\n新しい検索結果"
+
+def test_duckduckgo_fetches_share_one_deadline(monkeypatch):
+    timeouts = []
+
+    class FakeDDGS:
+        def __init__(self, timeout):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def text(self, query, **kwargs):
+            return [{"href": f"https://example.com/{i}", "title": "t", "body": "b"} for i in range(4)]
+
+    def fetch_raw_content(url, timeout):
+        timeouts.append(timeout)
+        time.sleep(min(0.4, timeout))
+        return "page"
+
+    monkeypatch.setitem(sys.modules, "duckduckgo_search", types.SimpleNamespace(DDGS=FakeDDGS))
+    monkeypatch.setattr(utils, "fetch_raw_content", fetch_raw_content)
+
+    started = time.monotonic()
+    results = utils.duckduckgo_search("q", fetch_full_page=True, timeout=1.0)["results"]
+
+    assert time.monotonic() - started < 1.0 + SLACK
+    #ページ取得には残り時間だけが渡され、期限を過ぎた後のページはスニペットを使う
+    assert len(timeouts) == 3 and timeouts[0] <= 1.0 and timeouts[1] <= 0.6 and timeouts[2] <= 0.2
+    assert [r["raw_content"] for r in results] == ["page", "page", "page", "b"]
@@ -0,0 +1,52 @@
+import json
+
+from deep_research.graph import parse_research_plan, plan_research
+from deep_research.state import SummaryState
+
+PLAN = {"knowledge_gap": "不足している内容", "follow_up_query": "追加の質問", "query": "検索 キーワード"}
+
+def test_valid_plan_is_returned_as_is():
+    assert parse_research_plan(json.dumps(PLAN)) == PLAN
+
+def test_whitespace_only_field_is_dropped():
+    plan = parse_research_plan(json.dumps({**PLAN, "follow_up_query": "   "}))
+    assert plan == {"knowledge_gap": "不足している内容", "query": "検索 キーワード"}
+
+def test_surrounding_whitespace_is_stripped():
+    assert parse_research_plan(json.dumps({**PLAN, "query": "  検索 キーワード \n"}))["query"] == "検索 キーワード"
+
+def test_field_with_wrong_type_is_dropped():
+    plan = parse_research_plan(json.dumps({**PLAN, "query": 123, "knowledge_gap": ["a"]}))
+    assert plan == {"follow_up_query": "追加の質問"}
+
+def test_non_dict_json_and_invalid_json_give_nothing():
+    assert parse_research_plan(json.dumps([PLAN])) == {}
+    assert parse_research_plan('"text"') == {}
+    assert parse_research_plan("not json") == {}
+
+def test_retry_fills_only_missing_fields(fake_llm):
+    fake_llm["responses"] = [
+        json.dumps({**PLAN, "follow_up_query": " "}),
+        #再生成では欠けていたフィールドだけを採用し、検証済みのqueryは上書きしない
+        json.dumps({"follow_up_query": "再生成した質問", "query": "別のキーワード"}),
+    ]
+    state = SummaryState(research_topic="テスト", running_summary="要約")
+
+    result = plan_research(state, {"configurable": {"fused_planner": True}})
+
+    assert result["search_query"] == "検索 キーワード"
+    assert result["query_history"] == ["再生成した質問"]
+    assert result["short_query_history"] == ["検索 キーワード"]
+    assert len(result["llm_usage"]) == 2
+    #再生成のスキーマは欠けていたフィールドだけを要求する
+    assert fake_llm["model_kwargs"][1]["format"]["required"] == ["follow_up_query"]
+
+def test_missing_fields_fall_back_after_retries(fake_llm):
+    fake_llm["content"] = json.dumps({"knowledge_gap": "不足している内容"})
+    state = SummaryState(research_topic="テスト", running_summary="要約")
+
+    result = plan_research(state, {"configurable": {"planner_max_retries": 2}})
+
+    assert len(result["llm_usage"]) == 3
+    assert result["query_history"] == ["テストについて教えて下さい"]
+    assert result["search_query"] == "テストについて教えて下さい"
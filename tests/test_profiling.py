@@ -0,0 +1,22 @@
+import tracemalloc
+
+from deep_research.profiling import profile_node
+
+@profile_node
+def node(state, config=None):
+    return {"items": [str(i) for i in range(1000)]}
+
+def test_profile_node_writes_reports(tmp_path):
+    node({}, {"configurable": {"profile_dir": str(tmp_path)}})
+
+    names = sorted(path.suffix for path in tmp_path.iterdir())
+    assert names == [".prof", ".txt"]
+    assert not tracemalloc.is_tracing()
+
+def test_caller_tracemalloc_session_is_kept(tmp_path):
+    tracemalloc.start()
+    try:
+        node({}, {"configurable": {"profile_dir": str(tmp_path)}})
+        assert tracemalloc.is_tracing()
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,169 @@
+import json
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from deep_research.service import create_app
+
+#1ループで終わる設定（検索ループを繰り返さずfinalize_summaryへ進む）
+CONFIGURABLE = {"max_web_research_loops": 0}
+
+def wait_for(predicate, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return
+        time.sleep(0.01)
+    raise AssertionError("condition was not met in time")
+
+def submit(client: TestClient, topic: str):
+    return client.post("/jobs", json={"research_topic": topic, "configurable": CONFIGURABLE})
+
+def read_events(client: TestClient, job_id: str):
+    events = []
+    with client.stream("GET", f"/jobs/{job_id}/events") as response:
+        assert response.headers["content-type"].startswith("text/event-stream")
+        for line in response.iter_lines():
+            if line.startswith("data: "):
+                events.append(json.loads(line[len("data: "):]))
+    return events
+
+@pytest.fixture
+def make_client(fake_llm, fake_search):
+    clients = []
+
+    def make(**kwargs):
+        client = TestClient(create_app(**kwargs))
+        client.__enter__()
+        clients.append(client)
+        return client, client.app.state.manager
+
+    yield make
+    for client in clients:
+        client.__exit__(None, None, None)
+
+def test_jobs_complete_and_stream_events(make_client):
+    client, _ = make_client(max_concurrency=2)
+
+    job_ids = [submit(client, f"topic {i}").json()["job_id"] for i in range(8)]
+
+    for job_id in job_ids:
+        events = read_events(client, job_id)
+        names = [event["event"] for event in events]
+        assert names[0] == "queued"
+        assert names[1] == "started"
+        assert names[-1] == "done"
+        nodes = [event["node"] for event in events if event["event"] == "node"]
+        assert nodes[0] == "generate_query"
+        assert nodes[-1] == "finalize_summary"
+        assert events[-1]["running_summary"]
+        assert client.get(f"/jobs/{job_id}").json()["status"] == "done"
+
+def test_full_queue_is_rejected_with_429(make_client, fake_llm):
+    fake_llm["delay"] = 0.5
+    client, manager = make_client(max_concurrency=1, max_queue=1, max_llm_backlog=100)
+
+    running = submit(client, "running").json()["job_id"]
+    wait_for(lambda: manager.jobs[running].status == "running")
+    assert submit(client, "queued").status_code == 202
+
+    response = submit(client, "rejected")
+    assert response.status_code == 429
+    assert response.headers["retry-after"] == "30"
+
+def test_llm_backlog_is_rejected_with_503(make_client, fake_llm):
+    fake_llm["delay"] = 0.5
+    client, manager = make_client(max_concurrency=1, max_queue=10, max_llm_backlog=1)
+
+    submit(client, "running")
+    #LLMの呼び出しはコールバックで数えられる
+    wait_for(lambda: manager.tracker.in_flight >= 1)
+
+    response = submit(client, "rejected")
+    assert response.status_code == 503
+    assert client.get("/health").json()["llm_in_flight"] >= 1
+
+def test_cancel_running_job(make_client, fake_llm):
+    fake_llm["delay"] = 0.5
+    client, manager = make_client(max_concurrency=1)
+
+    #実行中のLLM呼び出し数を監視する
+    peak_in_flight = 0
+    stop = threading.Event()
+
+    def monitor():
+        nonlocal peak_in_flight
+        while not stop.is_set():
+            peak_in_flight = max(peak_in_flight, manager.tracker.in_flight)
+            time.sleep(0.005)
+
+    thread = threading.Thread(target=monitor)
+    thread.start()
+    try:
+        job_id = submit(client, "cancelled").json()["job_id"]
+        wait_for(lambda: manager.tracker.in_flight == 1)
+
+        assert client.delete(f"/jobs/{job_id}").json()["status"] == "cancelling"
+        #キャンセル直後に投入したジョブは、実行中のLLM呼び出しが終わるまで始まらない
+        fake_llm["delay"] = 0.2
+        next_id = submit(client, "next").json()["job_id"]
+        wait_for(lambda: manager.jobs[job_id].status == "cancelled")
+        wait_for(lambda: manager.jobs[next_id].status == "done")
+    finally:
+        stop.set()
+        thread.join()
+
+    assert peak_in_flight <= 1
+    assert read_events(client, job_id)[-1]["event"] == "cancelled"
+    nodes = [e["node"] for e in read_events(client, job_id) if e["event"] == "node"]
+    assert "finalize_summary" not in nodes
+
+def test_cancel_queued_job_is_skipped(make_client, fake_llm):
+    fake_llm["delay"] = 0.3
+    client, manager = make_client(max_concurrency=1)
+
+    running = submit(client, "running").json()["job_id"]
+    queued = submit(client, "queued").json()["job_id"]
+    assert client.delete(f"/jobs/{queued}").json()["status"] == "cancelled"
+
+    wait_for(lambda: manager.jobs[running].status == "done")
+    assert manager.jobs[queued].status == "cancelled"
+    assert [event["event"] for event in read_events(client, queued)] == ["queued", "cancelled"]
+
+def test_load_admission_and_concurrency(make_client, fake_llm):
+    """受け付け可能な数を超えるジョブを投入し、受け付けたものはすべて終わり、同時実行数が守られることを確認する"""
+    fake_llm["delay"] = 0.05
+    client, manager = make_client(max_concurrency=3, max_queue=5, max_llm_backlog=100)
+
+    peak_running = 0
+    accepted, rejected = [], 0
+    for i in range(40):
+        response = submit(client, f"load {i}")
+        if response.status_code == 202:
+            accepted.append(response.json()["job_id"])
+        else:
+            assert response.status_code == 429
+            rejected += 1
+        peak_running = max(peak_running, manager.running)
+
+    assert accepted and rejected
+    for job_id in accepted:
+        wait_for(lambda: manager.jobs[job_id].status == "done")
+        peak_running = max(peak_running, manager.running)
+    assert peak_running <= 3
+
+@pytest.mark.parametrize("configurable", [
+    {"ollama_base_url": "http://169.254.169.254/"},
+    {"profile_dir": "/tmp/anywhere"},
+    {"max_web_research_loops": 1, "local_llm": "other-model"},
+    {"max_web_research_loops": "many"},
+])
+def test_server_side_configurable_is_rejected(make_client, configurable):
+    client, manager = make_client()
+
+    response = client.post("/jobs", json={"research_topic": "topic", "configurable": configurable})
+
+    assert response.status_code == 422
+    assert not manager.jobs
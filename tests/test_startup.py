@@ -0,0 +1,14 @@
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+
+def test_search_backends_and_ollama_are_not_loaded_at_import():
+    script = (
+        "import sys, deep_research.graph\n"
+        "print(','.join(m for m in ('tavily', 'duckduckgo_search', 'markdownify', 'langchain_ollama') if m in sys.modules))"
+    )
+    env = {**os.environ, "PYTHONPATH": SRC}
+    result = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True)
+    assert result.stdout.strip() == ""
@@ -0,0 +1,42 @@
+import json
+
+from deep_research.batch import run_topic
+from deep_research.graph import get_graph
+
+SUBTOPICS = ["サブトピック1", "サブトピック2", "サブトピック3"]
+
+def test_subtopic_loops_ignore_environment_override(monkeypatch, fake_llm, fake_search):
+    fake_llm["content"] = json.dumps({"query": "q", "follow_up_query": "f", "subtopics": SUBTOPICS})
+    monkeypatch.setenv("MAX_WEB_RESEARCH_LOOPS", "3")
+
+    result = get_graph().invoke(
+        {"research_topic": "テスト"},
+        {"configurable": {"decompose_topic": True, "subtopic_max_loops": 0}},
+    )
+
+    #subtopic_max_loops=0 なので、サブトピックごとに検索は1回だけ
+    assert fake_search["calls"] == len(SUBTOPICS)
+    assert result["running_summary"]
+
+def test_batch_records_timing_per_subtopic(fake_llm, fake_search):
+    fake_llm["content"] = json.dumps({"query": "q", "follow_up_query": "f", "subtopics": SUBTOPICS})
+    fake_llm["delay"] = 0.1
+
+    result = run_topic({"research_topic": "テスト"}, {"decompose_topic": True, "subtopic_max_loops": 0})
+
+    timings = [t for t in result["node_timings"] if t["node"] == "research_subtopic"]
+    assert sorted(t["research_topic"] for t in timings) == sorted(SUBTOPICS)
+    #各サブトピックはLLMを3回（クエリ生成・要約・振り返り）呼ぶため、後から届いたものも0秒にはならない
+    assert all(t["seconds"] >= 0.3 for t in timings)
+
+def test_output_lists_unique_source_urls(fake_llm, fake_search):
+    fake_llm["content"] = json.dumps({"query": "q", "follow_up_query": "f", "subtopics": SUBTOPICS})
+
+    result = get_graph().invoke(
+        {"research_topic": "テスト"},
+        {"configurable": {"decompose_topic": True, "subtopic_max_loops": 1}},
+    )
+
+    #スタブの検索はループ回数ごとに同じURLを返すため、サブトピック間の重複は1つにまとまる
+    assert fake_search["calls"] == 2 * len(SUBTOPICS)
+    assert sorted(result["source_urls"]) == ["https://example.com/0", "https://example.com/1"]
@@ -0,0 +1,95 @@
+import json
+from collections import Counter
+
+import pytest
+
+from deep_research.graph import get_graph
+from deep_research.tracing import configure_tracing, flush_traces, run_tree
+
+CONFIGURABLE = {"max_web_research_loops": 1}
+
+@pytest.fixture
+def local_traces(tmp_path):
+    path = tmp_path / "traces.jsonl"
+
+    def enable(sample_rate: float = 1.0):
+        configure_tracing(mode="local", sample_rate=sample_rate, path=str(path))
+        return path
+
+    yield enable
+    configure_tracing(mode="off")
+
+def read_spans(path):
+    flush_traces()
+    if not path.exists():
+        return []
+    return [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+
+def test_nodes_of_one_run_share_a_trace(local_traces, fake_llm, fake_search):
+    path = local_traces()
+
+    get_graph().invoke({"research_topic": "テスト"}, {"configurable": {"trace_id": "run-1", **CONFIGURABLE}})
+
+    spans = read_spans(path)
+    names = {span["name"] for span in spans}
+    assert {"generate_query_node", "web_research_node", "finalize_summary_node"} <= names
+    assert {span["trace_id"] for span in spans} == {"run-1"}
+
+def test_sampling_is_decided_per_run(local_traces, fake_llm, fake_search):
+    path = local_traces(sample_rate=1.0)
+    get_graph().invoke({"research_topic": "テスト"}, {"configurable": {"trace_id": "full", **CONFIGURABLE}})
+    spans_per_run = len(read_spans(path))
+
+    path.unlink()
+    local_traces(sample_rate=0.5)
+    runs = [f"run-{i}" for i in range(20)]
+    for run_id in runs:
+        get_graph().invoke({"research_topic": "テスト"}, {"configurable": {"trace_id": run_id, **CONFIGURABLE}})
+
+    counts = Counter(span["trace_id"] for span in read_spans(path))
+    #記録された実行はすべてのスパンがそろい、記録されなかった実行のスパンは1つもない
+    assert 0 < len(counts) < len(runs)
+    assert set(counts.values()) == {spans_per_run}
+
+def test_thread_id_is_used_when_trace_id_is_missing(local_traces, fake_llm, fake_search):
+    path = local_traces()
+
+    get_graph().invoke({"research_topic": "テスト"}, {"configurable": {"thread_id": "thread-1", **CONFIGURABLE}})
+
+    assert {span["trace_id"] for span in read_spans(path)} == {"thread-1"}
+
+def test_run_without_ids_is_one_trace(local_traces, fake_llm, fake_search):
+    path = local_traces()
+
+    get_graph().invoke({"research_topic": "テスト"}, {"configurable": CONFIGURABLE})
+    get_graph().invoke({"research_topic": "テスト"}, {"configurable": CONFIGURABLE})
+
+    counts = Counter(span["trace_id"] for span in read_spans(path))
+    assert len(counts) == 2
+    #終わった実行の親子関係は残らない
+    assert not run_tree.parents
+
+def test_subtopic_runs_share_the_parent_trace(local_traces, fake_llm, fake_search):
+    path = local_traces()
+    fake_llm["content"] = '{"query": "q", "follow_up_query": "f", "subtopics": ["a", "b"]}'
+
+    get_graph().invoke({"research_topic": "テスト"}, {"configurable": {"decompose_topic": True, "num_subtopics": 2,
+                                                                   "subtopic_max_loops": 1, **CONFIGURABLE}})
+
+    spans = read_spans(path)
+    assert {"research_subtopic_node", "web_research_node", "finalize_summary_node"} <= {span["name"] for span in spans}
+    assert len({span["trace_id"] for span in spans}) == 1
+
+def test_sampling_without_ids_is_decided_per_run(local_traces, fake_llm, fake_search):
+    path = local_traces(sample_rate=1.0)
+    get_graph().invoke({"research_topic": "テスト"}, {"configurable": CONFIGURABLE})
+    spans_per_run = len(read_spans(path))
+
+    path.unlink()
+    local_traces(sample_rate=0.5)
+    for _ in range(20):
+        get_graph().invoke({"research_topic": "テスト"}, {"configurable": CONFIGURABLE})
+
+    counts = Counter(span["trace_id"] for span in read_spans(path))
+    assert 0 < len(counts) < 20
+    assert set(counts.values()) == {spans_per_run}